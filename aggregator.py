@@ -0,0 +1,360 @@
+"""Локальный агрегатор: один процесс сканирует сессии, остальные забирают готовые снимки по HTTP
+    
+    python app.py --serve
+    curl http://127.0.0.1:47611/snapshot
+    curl "http://127.0.0.1:47611/breakdown?by=project"
+
+Ответы сериализуются один раз на снимок, запрос только отдаёт готовые байты.
+/snapshot?after=N — долгий опрос: ответ приходит, когда появится снимок новее N
+(номер снимка — в заголовке X-Snapshot-Seq и в поле seq).
+
+Каждый запрос, включая /health, несёт заголовок Authorization: Bearer <токен>.
+Токен агрегатор при старте пишет в файл, доступный только владельцу
+(~/.token_widget_aggregator.token), так что другие пользователи машины
+не читают чужой расход и не запускают сканы. На /health?nonce=N агрегатор
+отвечает ещё и proof — HMAC токена от N: клиент убеждается, что на порту
+именно его агрегатор, а не чужой процесс.
+"""
+import hashlib
+import hmac
+import json
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from token_core import (
+    BREAKDOWN_KEYS, EMPTY_USAGE, BillingWindow, MultiRootScanner, SessionSnapshot,
+    snapshot_from_dict, snapshot_to_dict, write_snapshot_file,
+)
+from snapshot_file import SnapshotFileWriter
+
+DEFAULT_AGGREGATOR_HOST = "127.0.0.1"
+DEFAULT_AGGREGATOR_PORT = 47611
+DEFAULT_AGGREGATOR_URL = f"http://{DEFAULT_AGGREGATOR_HOST}:{DEFAULT_AGGREGATOR_PORT}"
+DEFAULT_AGGREGATOR_TOKEN_PATH = os.path.join(os.path.expanduser("~"), ".token_widget_aggregator.token")
+# Сколько долгий опрос ждёт нового снимка, прежде чем вернуть текущий
+LONG_POLL_SECONDS = 25
+# Проверка, запущен ли агрегатор, не должна задерживать старт виджета
+PROBE_TIMEOUT = 0.5
+
+class AggregatorServer:
+    """Фоновый MultiRootScanner и HTTP на localhost, отвечающий заранее собранными байтами"""
+    
+    def __init__(self, scanner, host=DEFAULT_AGGREGATOR_HOST, port=DEFAULT_AGGREGATOR_PORT, token_path=DEFAULT_AGGREGATOR_TOKEN_PATH):
+        self.scanner = scanner
+        self.condition = threading.Condition()
+        self.seq = 0
+        # Ответы на текущий снимок: "snapshot", "model", "project" -> тело ответа
+        self.payloads = {}
+        self.health = {"roots": root_keys(scanner.roots), "pid": os.getpid()}
+        self.httpd = ThreadingHTTPServer((host, port), AggregatorHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.aggregator = self
+        # Токен пишется, только когда порт уже наш: агрегатор, не сумевший
+        # открыть порт, не должен подменить токен работающего
+        try:
+            self.token = write_token(token_path)
+        except OSError:
+            self.httpd.server_close()
+            raise
+        self.pump = None
+    
+    def publish(self, snapshot):
+        """Сериализовать снимок один раз и разбудить ждущие долгие опросы"""
+        data = snapshot_to_dict(snapshot)
+        with self.condition:
+            seq = self.seq + 1
+            data["seq"] = seq
+            payloads = {"snapshot": json.dumps(data, ensure_ascii=False).encode("utf-8")}
+            for by in BREAKDOWN_KEYS:
+                groups = (snapshot.breakdowns or {}).get(by, {})
+                payloads[by] = json.dumps({"seq": seq, "by": by, "groups": groups}, ensure_ascii=False).encode("utf-8")
+            self.seq = seq
+            self.payloads = payloads
+            self.condition.notify_all()
+    
+    def payload(self, name, after=0, timeout=0):
+        """(номер снимка, тело) — ждёт до timeout секунд снимка новее after; тело None, если снимков ещё нет"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > after, timeout=timeout)
+            return self.seq, self.payloads.get(name)
+    
+    def run_pump(self):
+        while True:
+            snapshot = self.scanner.snapshots.get()
+            if snapshot is None:
+                break
+            self.publish(snapshot)
+    
+    def serve_forever(self):
+        self.scanner.start()
+        self.pump = threading.Thread(target=self.run_pump, name="aggregator-pump", daemon=True)
+        self.pump.start()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.scanner.stop()
+            self.scanner.snapshots.put(None)
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+
+class AggregatorHandler(BaseHTTPRequestHandler):
+    server_version = "TokenWidgetAggregator/1"
+    
+    def do_GET(self):
+        if not self.authorized():
+            return
+        aggregator = self.server.aggregator
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/health":
+            health = dict(aggregator.health, proof=token_proof(aggregator.token, query.get("nonce", [""])[0]))
+            self.send_body(200, json.dumps(health).encode("utf-8"), aggregator.seq)
+            return
+        if url.path == "/snapshot":
+            name = "snapshot"
+        elif url.path == "/breakdown" and query.get("by", ["model"])[0] in BREAKDOWN_KEYS:
+            name = query.get("by", ["model"])[0]
+        else:
+            self.send_body(404, b'{"error": "not found"}', aggregator.seq)
+            return
+        
+        try:
+            after = int(query.get("after", ["0"])[0])
+        except ValueError:
+            self.send_body(400, b'{"error": "after must be an integer"}', aggregator.seq)
+            return
+        # Без after ответ сразу, если снимок уже есть; иначе ждём новый
+        timeout = LONG_POLL_SECONDS if "after" in query or not aggregator.seq else 0
+        seq, body = aggregator.payload(name, after, timeout)
+        if body is None:
+            self.send_body(503, b'{"error": "no scan yet"}', seq)
+        else:
+            self.send_body(200, body, seq)
+    
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if urlsplit(self.path).path == "/refresh":
+            self.server.aggregator.scanner.request_full_scan()
+            self.send_body(202, b"{}", self.server.aggregator.seq)
+        else:
+            self.send_body(404, b'{"error": "not found"}', self.server.aggregator.seq)
+    
+    def authorized(self):
+        """Проверить токен запроса; без верного токена ответ 401 на любой путь"""
+        expected = f"Bearer {self.server.aggregator.token}".encode("utf-8")
+        if hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"), expected):
+            return True
+        self.send_body(401, b'{"error": "unauthorized"}', 0)
+        return False
+    
+    def send_body(self, status, body, seq):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Snapshot-Seq", str(seq))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Опросы идут постоянно — журнал запросов только засорял бы консоль
+        pass
+
+def root_keys(roots):
+    """Каталоги сессий в виде, по которому клиент и агрегатор сверяют, что сканируют одно и то же"""
+    return sorted(os.path.abspath(os.path.expanduser(root)) for root in roots)
+
+def write_token(path):
+    """Записать новый токен агрегатора в файл с правами 0600 и вернуть его"""
+    token = secrets.token_urlsafe(32)
+    # mkstemp создаёт файл сразу с правами только для владельца, а замена
+    # целиком не оставляет читателям полузаписанный токен
+    fd, tmp_path = tempfile.mkstemp(prefix=".token-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return token
+
+def read_token(path):
+    """Токен агрегатора из файла; None, если агрегатор этого пользователя не запускался"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def token_proof(token, nonce):
+    """Доказательство знания токена для /health: HMAC-SHA256 от nonce клиента"""
+    return hmac.new(token.encode("utf-8"), nonce.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def fetch_json(url, timeout, data=None, token=None):
+    request = urllib.request.Request(url, data=data, headers={"Authorization": f"Bearer {token}"} if token else {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+class AggregatorClient:
+    """Тонкий клиент агрегатора с тем же интерфейсом, что у MultiRootScanner
+    
+    Снимки приходят долгим опросом /snapshot. Если агрегатор пропал, клиент
+    сам переключается на скан в своём процессе — fallback() создаёт сканер.
+    snapshot_path — куда, как и MultiRootScanner, писать бинарный снимок,
+    token — токен агрегатора для заголовка Authorization.
+    """
+    
+    def __init__(self, url, fallback, snapshot_path=None, token=None):
+        self.url = url.rstrip("/")
+        self.fallback = fallback
+        self.token = token
+        self.snapshot_file = SnapshotFileWriter(snapshot_path) if snapshot_path else None
+        self.local = None
+        self.seq = 0
+        self.snapshots = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    @property
+    def scanners(self):
+        return self.local.scanners if self.local is not None else []
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="aggregator-client", daemon=True)
+        self.thread.start()
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                data = fetch_json(f"{self.url}/snapshot?after={self.seq}", timeout=LONG_POLL_SECONDS + 5, token=self.token)
+            except urllib.error.HTTPError as e:
+                if e.code == 503:
+                    # Агрегатор ещё не закончил первый скан
+                    continue
+                self.switch_to_local(e)
+                return
+            except (OSError, ValueError) as e:
+                self.switch_to_local(e)
+                return
+            if data["seq"] > self.seq:
+                self.seq = data["seq"]
+                snapshot = snapshot_from_dict(data)
+                write_snapshot_file(self.snapshot_file, snapshot)
+                self.snapshots.put(snapshot)
+    
+    def switch_to_local(self, error):
+        if self.stop_event.is_set():
+            return
+        print(f"Агрегатор недоступен, сканируем в своём процессе: {error}")
+        # Дальше бинарный снимок пишет локальный сканер — писатель у файла один
+        if self.snapshot_file is not None:
+            self.snapshot_file.close()
+        local = self.fallback()
+        # Снимки локального сканера идут в ту же очередь, что и снимки агрегатора
+        local.snapshots = self.snapshots
+        self.local = local
+        local.start()
+    
+    def merge(self):
+        """Текущий снимок агрегатора — для первого кадра до долгого опроса"""
+        try:
+            data = fetch_json(f"{self.url}/snapshot", timeout=PROBE_TIMEOUT, token=self.token)
+        except (OSError, ValueError):
+            return SessionSnapshot(0, EMPTY_USAGE)
+        return snapshot_from_dict(data)
+    
+    def request_full_scan(self):
+        if self.local is not None:
+            self.local.request_full_scan()
+            return
+        try:
+            fetch_json(f"{self.url}/refresh", timeout=PROBE_TIMEOUT, data=b"", token=self.token)
+        except (OSError, ValueError) as e:
+            print(f"Агрегатор не принял запрос обновления: {e}")
+    
+    def pause(self):
+        # Агрегатор работает и на других клиентов — на паузу встаёт только свой скан
+        if self.local is not None:
+            self.local.pause()
+    
+    def resume(self):
+        if self.local is not None:
+            self.local.resume()
+    
+    def refresh_state(self):
+        return self.local.refresh_state() if self.local is not None else None
+    
+    def latest_snapshot(self):
+        """Последний готовый снимок (промежуточные пропускаются) или None"""
+        snapshot = None
+        try:
+            while True:
+                snapshot = self.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        return snapshot
+    
+    def stop(self):
+        self.stop_event.set()
+        if self.local is not None:
+            self.local.stop()
+        elif self.snapshot_file is not None:
+            self.snapshot_file.close()
+
+def connect_session_source(url, roots, fallback, snapshot_path=None, token_path=DEFAULT_AGGREGATOR_TOKEN_PATH):
+    """Клиент агрегатора, если он запущен, знает наш токен и сканирует те же каталоги, иначе fallback()
+    
+    Процесс на порту, не подтвердивший токен (например, другого пользователя),
+    не подходит, как и агрегатор с другим набором каталогов: его итоги — не наши.
+    """
+    token = read_token(token_path) if url else None
+    if token is not None:
+        nonce = secrets.token_hex(16)
+        try:
+            health = fetch_json(f"{url.rstrip('/')}/health?nonce={nonce}", timeout=PROBE_TIMEOUT, token=token)
+        except urllib.error.HTTPError as e:
+            # 401 — агрегатор перезапущен с новым токеном или порт занят чужим
+            print(f"Агрегатор {url} ответил {e.code} на /health — сканируем сами")
+            health = None
+        except (OSError, ValueError):
+            health = None
+        if isinstance(health, dict):
+            if not hmac.compare_digest(str(health.get("proof", "")), token_proof(token, nonce)):
+                print(f"Процесс на {url} не подтвердил токен агрегатора — сканируем сами")
+            elif health.get("roots") == root_keys(roots):
+                return AggregatorClient(url, fallback, snapshot_path, token)
+            else:
+                print(f"Агрегатор {url} сканирует другие каталоги — сканируем сами")
+    return fallback()
+
+def serve(args):
+    """python app.py --serve: агрегатор до Ctrl+C"""
+    billing = BillingWindow(args.billing_start_day, args.billing_reset)
+    scanner = MultiRootScanner(
+        args.sessions_dirs, ":memory:" if args.no_index else args.index,
+        workers=args.workers, metrics_path=args.metrics_file, billing=billing, breakdowns=True,
+        snapshot_path=args.snapshot_file, refresh=args.refresh,
+    )
+    try:
+        server = AggregatorServer(scanner, args.host, args.port, args.aggregator_token)
+    except OSError as e:
+        scanner.stop()
+        print(f"Не удалось запустить агрегатор на {args.host}:{args.port}: {e}")
+        return 1
+    print(f"Агрегатор слушает http://{args.host}:{args.port} ({', '.join(scanner.roots)}), токен в {args.aggregator_token}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
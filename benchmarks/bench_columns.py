@@ -0,0 +1,68 @@
+"""Итоги по колонкам сессий: NumPy против чистого Python
+    
+    python benchmarks/bench_columns.py --sessions 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import token_core
+from token_core import MODEL_MULTIPLIERS, SessionColumns
+
+def fill_columns(sessions, seed):
+    rng = random.Random(seed)
+    models = list(MODEL_MULTIPLIERS) + [None]
+    columns = SessionColumns()
+    for _ in range(sessions):
+        columns.add(rng.choice(models), (
+            rng.randint(0, 200_000), rng.randint(0, 50_000),
+            rng.randint(0, 500_000), rng.randint(0, 5_000_000),
+        ))
+    return columns
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+    
+    columns = fill_columns(args.sessions, args.seed)
+    result = {"sessions": args.sessions, "numpy": token_core.load_numpy() is not None}
+    
+    if token_core.numpy is not None:
+        result["numpy_seconds"], expected = best_of(args.repeat, columns.aggregate)
+    numpy_module, token_core.numpy = token_core.numpy, None
+    try:
+        result["python_seconds"], python_result = best_of(max(1, args.repeat // 5), columns.aggregate)
+    finally:
+        token_core.numpy = numpy_module
+    if numpy_module is not None:
+        # Оба пути должны давать одинаковые итоги
+        assert expected == python_result, "итоги NumPy и чистого Python расходятся"
+    
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"Сессий: {args.sessions:,}")
+    if "numpy_seconds" in result:
+        print(f"NumPy:        {result['numpy_seconds'] * 1000:.1f} мс")
+    print(f"Чистый Python: {result['python_seconds'] * 1000:.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Память сканера сессий на одну отслеживаемую сессию (tracemalloc)
+    
+    python benchmarks/bench_memory.py --sessions 200000 --projects 200
+
+Замеряется всё, что SessionScanner держит после полного скана и обхода
+опросом: кэш сессий, обходчик дерева и сводки расхода. Дерево сессий
+создаётся во временном каталоге до замера. Сводки растут с числом групп
+(час, модель, проект), а не сессий: у сгенерированных файлов mtime почти
+одинаковый, --spread-days раскидывает их по дням. Превышение --limit
+(по умолчанию 100 байт) завершает прогон с ошибкой.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from token_core import USAGE_HOUR, SessionIndex, SessionScanner
+from synthetic import generate_sessions
+
+def measure_scanner(root, index_path):
+    """(сканер, байт в памяти) после полного скана и одного обхода опросом"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        index = SessionIndex(index_path)
+        index.open()
+        scanner = SessionScanner(root, index)
+        scanner.scan_snapshot()
+        changed = scanner.walker.changes()
+        # Временные списки скана освобождены — остаётся то, что сканер держит
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert changed == set(), changed
+    return scanner, current
+
+def measure(sessions, projects, spread_days=0, seed=0):
+    """{"scan", "restart"}: байт на сессию сразу после холодного скана и после старта с индексом"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "sessions")
+        count = generate_sessions(
+            root, projects, max(1, sessions // projects),
+            payload_bytes=64, seed=seed, spread_days=spread_days,
+        )
+        index_path = os.path.join(tmp, "index.db")
+        result = {"sessions": count, "projects": projects}
+        for name in ("scan", "restart"):
+            scanner, current = measure_scanner(root, index_path)
+            assert scanner.cache.count == count
+            result[name] = {
+                "bytes_per_session": current / count,
+                "usage_hour_rows": len(scanner.usage.tables[USAGE_HOUR].rows),
+            }
+            scanner.index.close()
+            del scanner
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--spread-days", type=float, default=0)
+    parser.add_argument("--limit", type=float, default=100.0, help="допустимо байт на сессию")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    result = measure(args.sessions, args.projects, args.spread_days, args.seed)
+    result["limit_bytes"] = args.limit
+    print(json.dumps(result, indent=2))
+    worst = max(result["scan"]["bytes_per_session"], result["restart"]["bytes_per_session"])
+    if worst > args.limit:
+        print(f"{worst:.1f} байт на сессию — больше допустимых {args.limit:.0f}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Масштабирование холодного скана по числу процессов разбора
+    
+    python benchmarks/bench_parallel.py --projects 50 --sessions 200 --max-workers 8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from token_core import SessionIndex, SessionScanner
+from synthetic import generate_sessions
+
+def cold_scan(sessions_dir, workers):
+    """Время полного скана с пустым кэшем и пустым индексом"""
+    index = SessionIndex(":memory:")
+    index.open()
+    scanner = SessionScanner(sessions_dir, index, workers=workers)
+    start = time.perf_counter()
+    total = scanner.scan_snapshot().total
+    elapsed = time.perf_counter() - start
+    index.close()
+    return elapsed, total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=200, help="сессий на проект")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as sessions_dir:
+        files = generate_sessions(sessions_dir, args.projects, args.sessions)
+        results = []
+        expected_total = None
+        workers = 1
+        while workers <= args.max_workers:
+            best, total = min(cold_scan(sessions_dir, workers) for _ in range(args.repeat))
+            # Результат не должен зависеть от числа воркеров
+            if expected_total is None:
+                expected_total = total
+            assert total == expected_total, f"total {total} != {expected_total} при {workers} воркерах"
+            results.append({"workers": workers, "seconds": best, "files_per_second": files / best})
+            workers *= 2
+    
+    if args.json:
+        print(json.dumps({"files": files, "results": results}, indent=2))
+        return
+    
+    print(f"Файлов: {files}")
+    base = results[0]["seconds"]
+    for r in results:
+        print(f"{r['workers']:>3} воркеров: {r['seconds']:.3f} с  {r['files_per_second']:>10.0f} файл/с  ×{base / r['seconds']:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Пути скана и истории на синтетических деревьях сессий разного размера
+    
+    python benchmarks/bench_scan.py --sizes 1000 10000 100000 --output scan.json
+    python benchmarks/bench_scan.py --sizes 1000000 --payload-bytes 256 --sessions-per-project 2000
+
+Результат — JSON с коммитом и параметрами прогона, чтобы сравнивать регрессии между коммитами.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from token_core import HistoryStore, SessionIndex, SessionScanner, calculate_session_tokens
+from synthetic import generate_sessions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def list_session_files(sessions_dir):
+    paths = []
+    for project in os.scandir(sessions_dir):
+        if project.is_dir():
+            paths.extend(e.path for e in os.scandir(project.path) if e.name.endswith(".settings.json"))
+    return paths
+
+def tree_bytes(paths):
+    return sum(os.path.getsize(p) for p in paths)
+
+def bench_all_sessions(sessions_dir, workers, repeat):
+    """Холодный скан (пустые кэш и индекс) и повторный скан того же сканера"""
+    cold = []
+    warm = []
+    for _ in range(repeat):
+        index = SessionIndex(":memory:")
+        index.open()
+        scanner = SessionScanner(sessions_dir, index, workers=workers)
+        start = time.perf_counter()
+        total = scanner.scan_snapshot().total
+        cold.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        scanner.calculate_all_sessions()
+        warm.append(time.perf_counter() - start)
+        index.close()
+    return {"cold_seconds": min(cold), "warm_seconds": min(warm), "total_st": total}
+
+def bench_session_tokens(paths, sample, seed):
+    """Разбор отдельных файлов: среднее время на файл по случайной выборке"""
+    rng = random.Random(seed)
+    chosen = rng.sample(paths, min(sample, len(paths)))
+    failed = 0
+    start = time.perf_counter()
+    for path in chosen:
+        _, model, _ = calculate_session_tokens(path)
+        if model is None:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(chosen),
+        "seconds": elapsed,
+        "us_per_file": elapsed / len(chosen) * 1e6 if chosen else 0.0,
+        "unparsed": failed,
+    }
+
+def bench_history(history_days, records, seed):
+    """save_history (HistoryStore.record) и холодный load_history_total на истории в history_days дней"""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, ".token_history.json")
+        history = {f"day-{d:05d}": {"tokens": rng.randint(0, 1_000_000)} for d in range(history_days)}
+        with open(path, "w") as f:
+            json.dump(history, f)
+        
+        store = HistoryStore(path)
+        # Первый вызов переносит старый снимок в журнал — меряется отдельно
+        start = time.perf_counter()
+        store.load_total()
+        migrate = time.perf_counter() - start
+        
+        tokens = 0
+        start = time.perf_counter()
+        for _ in range(records):
+            tokens += rng.randint(1, 10_000)
+            store.record("today", tokens)
+        save = time.perf_counter() - start
+        
+        loads = []
+        for _ in range(20):
+            start = time.perf_counter()
+            HistoryStore(path).load_total()
+            loads.append(time.perf_counter() - start)
+    
+    return {
+        "history_days": history_days,
+        "migrate_seconds": migrate,
+        "save_history": {"records": records, "seconds": save, "us_per_record": save / records * 1e6},
+        "load_history_total": {"min_seconds": min(loads), "max_seconds": max(loads)},
+    }
+
+def bench_size(sessions, args):
+    projects = max(1, sessions // args.sessions_per_project)
+    per_project = max(1, sessions // projects)
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as sessions_dir:
+        start = time.perf_counter()
+        files = generate_sessions(
+            sessions_dir, projects, per_project,
+            payload_bytes=args.payload_bytes, seed=args.seed,
+            corrupt_ratio=args.corrupt_ratio, partial_ratio=args.partial_ratio,
+            malformed_ratio=args.malformed_ratio, vary_size=True, spread_days=30,
+        )
+        generate = time.perf_counter() - start
+        paths = list_session_files(sessions_dir)
+        return {
+            "sessions": files,
+            "projects": projects,
+            "bytes": tree_bytes(paths),
+            "generate_seconds": generate,
+            "calculate_all_sessions": bench_all_sessions(sessions_dir, args.workers, args.repeat),
+            "calculate_session_tokens": bench_session_tokens(paths, args.sample, args.seed),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="число сессий в дереве")
+    parser.add_argument("--sessions-per-project", type=int, default=500)
+    parser.add_argument("--payload-bytes", type=int, default=2048, help="медианный размер служебных данных сессии")
+    parser.add_argument("--corrupt-ratio", type=float, default=0.01)
+    parser.add_argument("--partial-ratio", type=float, default=0.01)
+    parser.add_argument("--malformed-ratio", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sample", type=int, default=2000, help="файлов для замера calculate_session_tokens")
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--history-records", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tmp-dir", help="где создавать деревья (для 1M сессий нужен быстрый диск)")
+    parser.add_argument("--output", help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+    
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "tmp_dir")},
+        "sizes": [],
+        "history": bench_history(args.history_days, args.history_records, args.seed),
+    }
+    for sessions in args.sizes:
+        result["sizes"].append(bench_size(sessions, args))
+        print(f"{sessions} сессий готово", file=sys.stderr)
+    
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Чтение бинарного снимка под непрерывной записью: стоимость read() и согласованность полей
+    
+    python benchmarks/bench_snapshot_file.py --seconds 3
+
+Писатель в отдельном процессе пишет снимки, в которых все поля выводятся из
+одного числа; читатель проверяет, что ни разу не увидел смесь двух записей.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from snapshot_file import SnapshotFileReader, SnapshotFileWriter
+
+def write_loop(path, ready, stop):
+    writer = SnapshotFileWriter(path)
+    i = 0
+    writer.write(i, i, 1, "model-0", (0, 0, 0, 0))
+    ready.set()
+    while not stop.is_set():
+        i += 1
+        writer.write(i, 2 * i, 1, f"model-{i}", (i, i + 1, i + 2, i + 3))
+    writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as state_dir:
+        path = os.path.join(state_dir, "snapshot.bin")
+        ready = multiprocessing.Event()
+        stop = multiprocessing.Event()
+        writer = multiprocessing.Process(target=write_loop, args=(path, ready, stop))
+        writer.start()
+        ready.wait()
+        
+        reader = SnapshotFileReader(path)
+        reads = misses = 0
+        seqs = set()
+        deadline = time.perf_counter() + args.seconds
+        start = time.perf_counter()
+        while time.perf_counter() < deadline:
+            values = reader.read()
+            reads += 1
+            if values is None:
+                misses += 1
+                continue
+            i = values.total_st
+            # Поля одной записи: смесь двух записей здесь не сойдётся
+            assert values.all_time_st == 2 * i, values
+            assert (values.input_tokens, values.output_tokens, values.cache_create, values.cache_read) == ((i, i + 1, i + 2, i + 3) if i else (0, 0, 0, 0)), values
+            assert values.model == f"model-{i}", values
+            seqs.add(values.seq)
+        elapsed = time.perf_counter() - start
+        reader.close()
+        stop.set()
+        writer.join()
+    
+    print(json.dumps({
+        "reads": reads,
+        "microseconds_per_read": elapsed / reads * 1e6,
+        "distinct_snapshots_seen": len(seqs),
+        "gave_up_reads": misses,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
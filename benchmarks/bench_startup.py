@@ -0,0 +1,59 @@
+"""Время старта: от запуска процесса до первого update_display
+    
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --headless --runs 10   # без дисплея: до вывода --headless --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+STARTUP_PROBE_ENV = "TOKEN_WIDGET_STARTUP_PROBE"
+
+def run_widget_once():
+    env = dict(os.environ)
+    env[STARTUP_PROBE_ENV] = repr(time.time())
+    proc = subprocess.run([sys.executable, APP], env=env, capture_output=True, text=True, timeout=60)
+    for line in proc.stdout.splitlines():
+        if line.startswith("STARTUP_SECONDS "):
+            return float(line.split()[1])
+    raise RuntimeError(f"виджет не сообщил время старта:\n{proc.stdout}{proc.stderr}")
+
+def run_headless_once(extra_args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, APP, "--headless", "--json"] + extra_args, capture_output=True, check=True, timeout=600)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--headless", action="store_true", help="мерить консольный режим вместо окна")
+    parser.add_argument("--sessions-dir", help="каталог сессий для --headless")
+    parser.add_argument("--json", action="store_true", help="вывести результаты в JSON")
+    args = parser.parse_args()
+    
+    extra_args = ["--sessions-dir", args.sessions_dir] if args.sessions_dir else []
+    samples = []
+    for _ in range(args.runs):
+        samples.append(run_headless_once(extra_args) if args.headless else run_widget_once())
+    
+    result = {
+        "mode": "headless" if args.headless else "widget",
+        "runs": args.runs,
+        "min_seconds": min(samples),
+        "median_seconds": statistics.median(samples),
+        "max_seconds": max(samples),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['mode']}: min {result['min_seconds'] * 1000:.1f} мс, "
+              f"медиана {result['median_seconds'] * 1000:.1f} мс, max {result['max_seconds'] * 1000:.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Генератор синтетического дерева ~/.factory/sessions для бенчмарков"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from token_core import MODEL_MULTIPLIERS
+
+# Все модели с известным множителем и одна неизвестная (множитель 1.0)
+MODELS = list(MODEL_MULTIPLIERS) + ["unreleased-model-preview"]
+# Что встречается вместо имени модели и счётчика токенов в испорченных сессиях
+MALFORMED_MODELS = [None, 42, ["gpt-5.1"], {"name": "gpt-5.1"}]
+MALFORMED_COUNTS = [None, "12abc", -5, 1 << 70, {"value": 1}, [1]]
+
+def nested_payload(rng, payload_bytes):
+    """Служебные данные в виде вложенных объектов и массивов (история сообщений)"""
+    messages = []
+    size = 0
+    while size < payload_bytes:
+        text = "x" * rng.randint(16, 256)
+        messages.append({
+            "role": rng.choice(["user", "assistant"]),
+            "content": [{"type": "text", "text": text}],
+            "meta": {"id": rng.getrandbits(32), "tags": ["a", "b"], "quoted": '"[{'},
+        })
+        size += len(text) + 120
+    return messages
+
+def session_json(rng, payload_bytes, malformed_ratio=0.0):
+    """JSON одной сессии; с вероятностью malformed_ratio модель или один из счётчиков испорчены"""
+    # У половины сессий служебные данные — одна длинная строка, у половины —
+    # вложенные объекты и массивы, которые быстрый разбор пропускает по скобкам
+    payload = "x" * payload_bytes if rng.random() < 0.5 else nested_payload(rng, payload_bytes)
+    data = {
+        "model": rng.choice(MODELS),
+        "tokenUsage": {
+            "inputTokens": rng.randint(0, 200_000),
+            "outputTokens": rng.randint(0, 50_000),
+            "cacheCreationTokens": rng.randint(0, 500_000),
+            "cacheReadTokens": rng.randint(0, 5_000_000),
+        },
+        "payload": payload,
+    }
+    if rng.random() < malformed_ratio:
+        if rng.random() < 0.5:
+            data["model"] = rng.choice(MALFORMED_MODELS)
+        else:
+            data["tokenUsage"][rng.choice(list(data["tokenUsage"]))] = rng.choice(MALFORMED_COUNTS)
+    # У части сессий служебные поля идут после tokenUsage, у части — до
+    if rng.random() < 0.5:
+        data = {"payload": data.pop("payload"), **data}
+    return json.dumps(data)
+
+def generate_sessions(root, projects, sessions_per_project, payload_bytes=2048, seed=0,
+                      corrupt_ratio=0.0, partial_ratio=0.0, vary_size=False, spread_days=0, malformed_ratio=0.0):
+    """Создать projects × sessions_per_project файлов .settings.json, вернуть число файлов
+    
+    corrupt_ratio — доля файлов с мусором вместо JSON, partial_ratio — доля
+    недописанных файлов (обрезаны в случайном месте), malformed_ratio — доля
+    файлов с испорченными model или счётчиком токенов. При vary_size размер
+    служебных данных разбросан логнормально вокруг payload_bytes, spread_days
+    раскидывает mtime файлов по последним дням.
+    """
+    rng = random.Random(seed)
+    now = time.time()
+    count = 0
+    for p in range(projects):
+        project_path = os.path.join(root, f"project-{p:04d}")
+        os.makedirs(project_path, exist_ok=True)
+        for _ in range(sessions_per_project):
+            session_id = uuid.UUID(int=rng.getrandbits(128))
+            size = int(payload_bytes * rng.lognormvariate(0, 1)) if vary_size else payload_bytes
+            text = session_json(rng, size, malformed_ratio)
+            
+            kind = rng.random()
+            if kind < corrupt_ratio:
+                text = "".join(rng.choice("{}[]\",:0123456789abc \n") for _ in range(rng.randint(1, 256)))
+            elif kind < corrupt_ratio + partial_ratio:
+                text = text[:rng.randint(0, len(text) - 1)]
+            
+            path = os.path.join(project_path, f"{session_id}.settings.json")
+            with open(path, "w") as f:
+                f.write(text)
+            if spread_days:
+                mtime = now - rng.uniform(0, spread_days * 86400)
+                os.utime(path, (mtime, mtime))
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Создать синтетический каталог сессий (например, для app.py --profile)")
+    parser.add_argument("root", help="куда положить проекты с сессиями")
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=500, help="сессий на проект")
+    parser.add_argument("--payload-bytes", type=int, default=2048)
+    parser.add_argument("--corrupt-ratio", type=float, default=0.01)
+    parser.add_argument("--partial-ratio", type=float, default=0.01)
+    parser.add_argument("--malformed-ratio", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    count = generate_sessions(
+        args.root, args.projects, args.sessions,
+        payload_bytes=args.payload_bytes, seed=args.seed,
+        corrupt_ratio=args.corrupt_ratio, partial_ratio=args.partial_ratio,
+        malformed_ratio=args.malformed_ratio, vary_size=True, spread_days=30,
+    )
+    print(f"Создано сессий: {count} в {args.root}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Профилирование цикла обновления виджета: python app.py --profile N"""
+import cProfile
+import io
+import os
+import platform
+import pstats
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from token_core import MONTHLY_LIMIT, BillingWindow, HistoryStore, MultiRootScanner
+from view_model import MODE_FULL, build_view_state, diff_view_state
+
+# Сколько строк статистики попадает в отчёт
+REPORT_LINES = 40
+TRACEMALLOC_LINES = 25
+
+class CoreRefresh:
+    """Цикл обновления без Tk: те же шаги, что TokenWidget.apply_snapshot, на функциях ядра"""
+    
+    description = "без окна (update_display — только build_view_state/diff_view_state)"
+    
+    def __init__(self, sessions_dirs, state_dir, workers, billing):
+        self.scanner = MultiRootScanner(sessions_dirs, ":memory:", workers=workers, billing=billing, breakdowns=True)
+        self.history = HistoryStore(os.path.join(state_dir, ".token_history.json"))
+        self.rendered_state = {}
+        self.warning_shown = False
+    
+    def cycle(self):
+        # Корни сканируются в этом потоке: cProfile видит только поток, в котором включён
+        snapshot = self.scanner.scan_snapshot_inline()
+        total_st = snapshot.window["total_st"] if snapshot.window else snapshot.total
+        
+        # update_display
+        state = build_view_state(
+            MODE_FULL, total_st, snapshot.usage, snapshot.metrics, snapshot.window,
+            snapshot.roots, snapshot.breakdowns, self.scanner.refresh_state(),
+        )
+        for name, options in diff_view_state(self.rendered_state, state).items():
+            self.rendered_state.setdefault(name, {}).update(options)
+        
+        # save_history
+        self.history.record(datetime.now().strftime("%Y-%m-%d"), total_st)
+        
+        # check_limit_warning
+        if not self.warning_shown and total_st / MONTHLY_LIMIT * 100 >= 90:
+            self.warning_shown = True
+        return snapshot
+    
+    def close(self):
+        self.scanner.stop()
+
+class WidgetRefresh:
+    """Цикл обновления настоящего окна в полном режиме, без mainloop и фонового сканера"""
+    
+    description = "окно Tk, полный режим"
+    
+    def __init__(self, sessions_dirs, state_dir, workers):
+        import tkinter as tk
+        from widget import TokenWidget
+        
+        self.root = tk.Tk()
+        self.widget = TokenWidget(self.root, session_roots=sessions_dirs, state_dir=state_dir, interactive=False)
+        for scanner in self.widget.session_scanner.scanners:
+            scanner.workers = max(1, workers)
+        # Модальное окно предупреждения остановило бы профилирование
+        self.widget.notify_enabled = False
+        self.widget.miniature_mode = False
+        self.widget.compact_mode = False
+        self.widget.create_ui()
+    
+    def cycle(self):
+        snapshot = self.widget.session_scanner.scan_snapshot_inline()
+        self.widget.apply_snapshot(snapshot)
+        # Отрисовка Tk происходит в idle-задачах — они тоже часть цикла
+        self.root.update_idletasks()
+        return snapshot
+    
+    def close(self):
+        self.widget.cleanup_on_exit()
+        self.root.destroy()
+
+def create_refresh(args, state_dir):
+    if not args.headless:
+        try:
+            return WidgetRefresh(args.sessions_dirs, state_dir, args.workers)
+        except Exception as e:
+            # Нет дисплея или tkinter — профилируем то же без окна
+            print(f"Окно недоступно, профилируем без него: {e}")
+    return CoreRefresh(args.sessions_dirs, state_dir, args.workers, BillingWindow(args.billing_start_day, args.billing_reset))
+
+def format_report(args, refresh, timings, snapshot, stats, memory):
+    out = io.StringIO()
+    out.write(f"Профиль цикла обновления — {datetime.now().isoformat(timespec='seconds')}\n")
+    out.write(f"Python {platform.python_version()}, {platform.platform()}\n")
+    out.write(f"Режим: {refresh.description}\n")
+    out.write(f"Сессии: {', '.join(args.sessions_dirs)}\n")
+    out.write(f"Циклов: {len(timings)}, процессов разбора: {args.workers}\n")
+    if snapshot is not None and snapshot.metrics:
+        out.write(f"Последний скан: {snapshot.metrics['last']}\n")
+    out.write(f"\nВремя цикла, мс: первый (холодный) {timings[0] * 1000:.2f}")
+    if len(timings) > 1:
+        warm = timings[1:]
+        out.write(f", остальные: min {min(warm) * 1000:.2f}, медиана {statistics.median(warm) * 1000:.2f}, max {max(warm) * 1000:.2f}")
+    out.write("\n")
+    
+    for sort_key in ("cumulative", "tottime"):
+        out.write(f"\n=== cProfile, сортировка {sort_key} ===\n")
+        pstats.Stats(stats, stream=out).sort_stats(sort_key).print_stats(REPORT_LINES)
+    
+    if memory is not None:
+        top, current, peak = memory
+        out.write(f"\n=== tracemalloc: сейчас {current / 1024:.1f} КБ, пик {peak / 1024:.1f} КБ ===\n")
+        for stat in top:
+            out.write(f"{stat}\n")
+    return out.getvalue()
+
+def run_profile(args):
+    """Прогнать args.profile циклов обновления под cProfile и записать отчёт и .pstats"""
+    out_prefix = os.path.abspath(args.profile_out)
+    with tempfile.TemporaryDirectory() as state_dir:
+        # Конфиг, история и индекс — во временном каталоге: профиль не трогает
+        # данные пользователя и каждый раз начинается с холодного кэша
+        refresh = create_refresh(args, state_dir)
+        profiler = cProfile.Profile()
+        timings = []
+        snapshot = None
+        if args.tracemalloc:
+            tracemalloc.start()
+        try:
+            for _ in range(args.profile):
+                start = time.perf_counter()
+                profiler.enable()
+                snapshot = refresh.cycle()
+                profiler.disable()
+                timings.append(time.perf_counter() - start)
+            
+            memory = None
+            if args.tracemalloc:
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:TRACEMALLOC_LINES]
+                memory = (top, current, peak)
+        finally:
+            if args.tracemalloc:
+                tracemalloc.stop()
+            refresh.close()
+    
+    stats_path = out_prefix + ".pstats"
+    report_path = out_prefix + ".txt"
+    profiler.dump_stats(stats_path)
+    report = format_report(args, refresh, timings, snapshot, profiler, memory)
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(report)
+    
+    print(f"Циклов: {len(timings)}, медиана {statistics.median(timings) * 1000:.2f} мс")
+    print(f"Отчёт: {report_path}")
+    print(f"pstats: {stats_path}")
+    return 0
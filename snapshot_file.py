@@ -0,0 +1,180 @@
+"""Бинарный снимок итогов в файле фиксированной разметки для частых читателей
+
+Строка приглашения оболочки, статус tmux или плагин редактора опрашивают
+итог много раз в секунду — им не нужны ни Python, ни JSON: достаточно
+отобразить файл в память и прочитать поля по смещениям.
+    
+    python snapshot_file.py                      # 12,345,678 ST 61.7% claude-opus-4-5-20251101
+    python snapshot_file.py --format "{percent:.0f}%"
+
+Разметка (little-endian, смещения в байтах):
+    
+    0   4s  magic b"TWSF"
+    4   H   версия разметки (1)
+    6   H   размер снимка в байтах (SNAPSHOT_SIZE)
+    8   Q   seq — счётчик записей: нечётный, пока идёт запись
+    16  q   total_st — расход за расчётный период (или за всё время)
+    24  q   all_time_st — расход за всё время
+    32  q   limit — MONTHLY_LIMIT
+    40  d   percent — total_st / limit * 100
+    48  q   updated_ns — время записи, наносекунды Unix
+    56  q   input_tokens    } счётчики последней сессии
+    64  q   output_tokens   }
+    72  q   cache_create    }
+    80  q   cache_read      }
+    88  64s model — имя модели в UTF-8, дополненное нулями
+
+Согласованное чтение без блокировок (seqlock): прочитать seq; если он
+нечётный — запись идёт, повторить; прочитать поля; прочитать seq ещё раз —
+если не совпал, повторить. После сотни неудачных попыток подряд стоит
+уступить процессор (писатель вытеснен посреди записи) и повторять с паузами. Модуль без зависимостей, кроме стандартной библиотеки.
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.expanduser("~"), ".token_widget_snapshot.bin")
+
+SNAPSHOT_MAGIC = b"TWSF"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct("<4sHH")
+_SEQ = struct.Struct("<Q")
+_BODY = struct.Struct("<qqqdqqqqq64s")
+SEQ_OFFSET = _HEADER.size
+BODY_OFFSET = SEQ_OFFSET + _SEQ.size
+SNAPSHOT_SIZE = BODY_OFFSET + _BODY.size
+MODEL_BYTES = 64
+# Сколько раз читатель сразу повторяет чтение, попадая на запись
+READ_SPINS = 100
+# Дальше он уступает процессор писателю: паузы от READ_BACKOFF_SECONDS
+# с удвоением, пока не выйдет READ_TIMEOUT_SECONDS
+READ_BACKOFF_SECONDS = 0.0001
+READ_TIMEOUT_SECONDS = 0.1
+
+SnapshotValues = namedtuple("SnapshotValues", (
+    "seq", "total_st", "all_time_st", "limit", "percent", "updated_ns",
+    "input_tokens", "output_tokens", "cache_create", "cache_read", "model",
+))
+
+class SnapshotFileWriter:
+    """Запись снимка в отображённый файл; писатель у файла должен быть один"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.map = None
+        self.seq = 0
+    
+    def open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            valid = False
+            if os.fstat(fd).st_size == SNAPSHOT_SIZE:
+                header = os.read(fd, BODY_OFFSET)
+                valid = len(header) == BODY_OFFSET and _HEADER.unpack_from(header) == (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_SIZE)
+            if not valid:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, SNAPSHOT_SIZE)
+            self.map = mmap.mmap(fd, SNAPSHOT_SIZE)
+        finally:
+            # Отображение держит файл само
+            os.close(fd)
+        if valid:
+            # Продолжаем счёт прежнего писателя, чтобы читатели увидели новую запись
+            self.seq = (_SEQ.unpack_from(self.map, SEQ_OFFSET)[0] + 1) & ~1
+        else:
+            _HEADER.pack_into(self.map, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_SIZE)
+    
+    def write(self, total_st, all_time_st, limit, model, counts):
+        """Записать снимок; counts — input, output, cache_create, cache_read последней сессии"""
+        model_bytes = (model or "").encode("utf-8")[:MODEL_BYTES]
+        percent = total_st / limit * 100 if limit else 0.0
+        with self.lock:
+            if self.map is None:
+                self.open()
+            # Нечётный seq — читатели знают, что поля сейчас меняются
+            _SEQ.pack_into(self.map, SEQ_OFFSET, self.seq + 1)
+            _BODY.pack_into(
+                self.map, BODY_OFFSET, total_st, all_time_st, limit, percent,
+                time.time_ns(), *counts, model_bytes,
+            )
+            self.seq += 2
+            _SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+    
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+
+class SnapshotFileReader:
+    """Чтение снимка из отображённого файла: файл открывается один раз, read() — без системных вызовов"""
+    
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < SNAPSHOT_SIZE or _HEADER.unpack_from(self.map) != (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_SIZE):
+            self.map.close()
+            raise ValueError(f"{path}: не снимок Token Widget версии {SNAPSHOT_VERSION}")
+    
+    def read(self):
+        """Согласованный снимок (SnapshotValues) или None, если писатель так и не закончил запись"""
+        deadline = None
+        delay = 0
+        while True:
+            for _ in range(READ_SPINS):
+                values = self.read_once()
+                if values is not None:
+                    return values
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT_SECONDS
+            elif time.monotonic() >= deadline:
+                return None
+            # Писатель вытеснен посреди записи — пока он не допишет, крутиться бесполезно
+            time.sleep(delay)
+            delay = min(delay * 2 or READ_BACKOFF_SECONDS, READ_TIMEOUT_SECONDS)
+    
+    def read_once(self):
+        """Одна попытка seqlock-чтения: снимок или None, если попали на запись"""
+        seq = _SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+        if seq & 1:
+            return None
+        body = _BODY.unpack_from(self.map, BODY_OFFSET)
+        if _SEQ.unpack_from(self.map, SEQ_OFFSET)[0] != seq:
+            return None
+        model = body[-1].rstrip(b"\0").decode("utf-8", "replace") or None
+        return SnapshotValues(seq, *body[:-1], model)
+    
+    def close(self):
+        self.map.close()
+
+def read_snapshot(path=DEFAULT_SNAPSHOT_PATH):
+    """Разовое чтение снимка; для частого опроса лучше держать SnapshotFileReader"""
+    reader = SnapshotFileReader(path)
+    try:
+        return reader.read()
+    finally:
+        reader.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=DEFAULT_SNAPSHOT_PATH)
+    parser.add_argument("--format", default="{total_st:,} ST {percent:.1f}% {model}", help="шаблон str.format по полям SnapshotValues")
+    args = parser.parse_args(argv)
+    try:
+        values = read_snapshot(args.path)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if values is None:
+        return 1
+    print(args.format.format(**values._replace(model=values.model or "?")._asdict()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import json
+import os
+import stat
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from aggregator import AggregatorClient, AggregatorServer, connect_session_source, read_token
+
+@pytest.fixture
+def server(tmp_path):
+    scanner = SimpleNamespace(roots=[str(tmp_path / "sessions")])
+    server = AggregatorServer(scanner, "127.0.0.1", 0, str(tmp_path / "token"))
+    thread = threading.Thread(target=server.httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.httpd.server_close()
+
+def url_of(server):
+    return f"http://127.0.0.1:{server.httpd.server_address[1]}"
+
+def status(url, token=None):
+    request = urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"} if token else {})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def test_token_file_is_private(server, tmp_path):
+    path = tmp_path / "token"
+    assert read_token(str(path)) == server.token
+    if os.name == "posix":
+        assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+def test_every_request_needs_the_token(server):
+    url = url_of(server)
+    for path in ("/health", "/snapshot", "/breakdown?by=model"):
+        assert status(url + path) == 401
+        assert status(url + path, "wrong") == 401
+    assert status(url + "/health", server.token) == 200
+    request = urllib.request.Request(url + "/refresh", data=b"", method="POST")
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request, timeout=5)
+    assert error.value.code == 401
+
+def test_client_connects_only_with_the_right_token(server, tmp_path):
+    roots = [str(tmp_path / "sessions")]
+    fallback = lambda: "local"
+    source = connect_session_source(url_of(server), roots, fallback, token_path=str(tmp_path / "token"))
+    assert isinstance(source, AggregatorClient)
+    assert source.token == server.token
+    
+    (tmp_path / "stale").write_text("old-token")
+    assert connect_session_source(url_of(server), roots, fallback, token_path=str(tmp_path / "stale")) == "local"
+    assert connect_session_source(url_of(server), roots, fallback, token_path=str(tmp_path / "missing")) == "local"
+
+def test_client_rejects_server_without_proof(tmp_path):
+    # Чужой процесс на порту принимает любой токен, но не знает его
+    roots = [str(tmp_path / "sessions")]
+    class Impostor(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({"roots": roots, "proof": "0" * 64}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            pass
+    
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Impostor)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        (tmp_path / "token").write_text("secret")
+        url = f"http://127.0.0.1:{httpd.server_address[1]}"
+        assert connect_session_source(url, roots, lambda: "local", token_path=str(tmp_path / "token")) == "local"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
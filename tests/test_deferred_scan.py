@@ -0,0 +1,49 @@
+import json
+import os
+import time
+
+from token_core import SessionIndex, SessionScanner
+
+OLD = "00000000-0000-0000-0000-000000000001.settings.json"
+NEW = "00000000-0000-0000-0000-000000000002.settings.json"
+
+def write_session(path, input_tokens, mtime):
+    with open(path, "w") as f:
+        json.dump({"model": "glm-4.6", "tokenUsage": {"inputTokens": input_tokens}}, f)
+    os.utime(path, (mtime, mtime))
+
+def open_scanner(root, index_path):
+    index = SessionIndex(index_path)
+    index.open()
+    return SessionScanner(root, index)
+
+def test_old_sessions_are_parsed_after_window_and_only_once(tmp_path):
+    project = tmp_path / "sessions" / "project"
+    project.mkdir(parents=True)
+    # Старый файл — за два месяца до текущего периода, новый — сейчас
+    write_session(project / OLD, 4000, time.time() - 62 * 86400)
+    write_session(project / NEW, 1000, time.time())
+    root = str(tmp_path / "sessions")
+    index_path = str(tmp_path / "index.db")
+    
+    scanner = open_scanner(root, index_path)
+    total, _ = scanner.calculate_all_sessions()
+    assert total == 250
+    assert scanner.usage.window_total == 250
+    assert scanner.metrics.last["files_deferred"] == 1
+    assert [path for path, _, _ in scanner.deferred] == [str(project / OLD)]
+    
+    total, _ = scanner.calculate_deferred_sessions()
+    assert total == 1250
+    assert scanner.usage.window_total == 250
+    assert scanner.calculate_deferred_sessions() is None
+    scanner.index.close()
+    
+    # После перезапуска оба файла берутся из индекса
+    scanner = open_scanner(root, index_path)
+    snapshot = scanner.scan_snapshot()
+    assert snapshot.total == 1250
+    assert snapshot.window["total_st"] == 250
+    assert scanner.metrics.totals["files_parsed"] == 0
+    assert scanner.metrics.totals["files_deferred"] == 0
+    scanner.index.close()
@@ -0,0 +1,9 @@
+"""Память SessionScanner на отслеживаемую сессию: меньше 100 байт"""
+from bench_memory import measure
+
+BYTES_PER_SESSION_LIMIT = 100
+
+def test_scanner_memory_per_session():
+    result = measure(sessions=10_000, projects=20)
+    for name in ("scan", "restart"):
+        assert result[name]["bytes_per_session"] < BYTES_PER_SESSION_LIMIT, result
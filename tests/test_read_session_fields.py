@@ -0,0 +1,24 @@
+import json
+
+from token_core import SESSION_HEAD_BYTES, read_session_fields, scan_session_file
+
+USAGE = {"inputTokens": 10, "outputTokens": 2}
+
+def test_bytes_read_counts_bytes_not_characters(tmp_path):
+    path = tmp_path / "s.settings.json"
+    path.write_bytes(json.dumps({"model": "glm-4.6", "tokenUsage": USAGE, "title": "тест"}, ensure_ascii=False).encode("utf-8"))
+    usage, bytes_read, error = scan_session_file(str(path))
+    assert error is None
+    assert usage.input == 10
+    assert bytes_read == path.stat().st_size
+
+def test_character_split_by_head_boundary(tmp_path):
+    # Двухбайтовый символ разрезан границей начального куска, поля — в хвосте
+    prefix = '{"title": "' + "x" * (SESSION_HEAD_BYTES - 12)
+    text = prefix + 'ж", "model": "gpt-5.1", "tokenUsage": ' + json.dumps(USAGE) + "}"
+    path = tmp_path / "s.settings.json"
+    path.write_bytes(text.encode("utf-8"))
+    assert len(prefix.encode("utf-8")) == SESSION_HEAD_BYTES - 1
+    model, token_usage, bytes_read = read_session_fields(str(path))
+    assert (model, token_usage) == ("gpt-5.1", USAGE)
+    assert bytes_read == path.stat().st_size
@@ -0,0 +1,14 @@
+from token_core import SessionCache, SessionUsage
+
+FIRST = "/sessions/p/00000000-0000-0000-0000-000000000001.settings.json"
+SECOND = "/sessions/p/00000000-0000-0000-0000-000000000002.settings.json"
+
+def test_latest_follows_mtime_moving_backwards():
+    cache = SessionCache()
+    cache.put(SECOND, 100, 1, SessionUsage("gpt-5.1", 1, 0, 0, 0))
+    cache.put(FIRST, 200, 1, SessionUsage("glm-4.6", 1, 0, 0, 0))
+    assert cache.latest().model == "glm-4.6"
+    # Файл восстановлен из копии со старым mtime — последней становится другая сессия
+    cache.put(FIRST, 50, 1, SessionUsage("glm-4.6", 1, 0, 0, 0))
+    assert cache.latest().model == "gpt-5.1"
+    assert cache.latest_mtime() == 100
@@ -0,0 +1,33 @@
+import time
+
+import snapshot_file
+from snapshot_file import SEQ_OFFSET, SnapshotFileReader, SnapshotFileWriter, _SEQ
+
+def test_reader_sees_written_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    writer = SnapshotFileWriter(path)
+    writer.write(123, 456, 1000, "gpt-5.1", (1, 2, 3, 4))
+    reader = SnapshotFileReader(path)
+    try:
+        values = reader.read()
+    finally:
+        reader.close()
+        writer.close()
+    assert (values.total_st, values.all_time_st, values.percent, values.model) == (123, 456, 12.3, "gpt-5.1")
+    assert (values.input_tokens, values.cache_read) == (1, 4)
+
+def test_reader_gives_up_on_stuck_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_file, "READ_TIMEOUT_SECONDS", 0.05)
+    path = str(tmp_path / "snapshot.bin")
+    writer = SnapshotFileWriter(path)
+    writer.write(1, 1, 1, None, (0, 0, 0, 0))
+    # Писатель «упал» посреди записи: seq остался нечётным
+    _SEQ.pack_into(writer.map, SEQ_OFFSET, writer.seq + 1)
+    reader = SnapshotFileReader(path)
+    try:
+        start = time.monotonic()
+        assert reader.read() is None
+        assert time.monotonic() - start < 1
+    finally:
+        reader.close()
+        writer.close()
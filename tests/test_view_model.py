@@ -0,0 +1,70 @@
+from token_core import MONTHLY_LIMIT, REFRESH_ACTIVE, REFRESH_PAUSED, SessionUsage
+from view_model import (
+    COMPACT_BAR_WIDTH, FULL_BAR_WIDTH, MODE_COMPACT, MODE_FULL, MODE_MINIATURE,
+    build_view_state, diff_view_state,
+)
+
+SONNET = SessionUsage("claude-sonnet-4-5-20250929", 1000, 200, 3000, 40000)
+
+def test_modes_return_their_widgets():
+    miniature = build_view_state(MODE_MINIATURE, 1_000_000, SONNET)
+    assert miniature == {"percent_label": {"text": "5.0%"}}
+    
+    compact = build_view_state(MODE_COMPACT, 1_000_000, SONNET)
+    assert set(compact) == {"total_label", "percent_label", "progress_bar", "model_label"}
+    assert compact["model_label"]["text"] == "Sonnet"
+    assert compact["progress_bar"]["width"] == COMPACT_BAR_WIDTH // 20
+    
+    full = build_view_state(MODE_FULL, 1_000_000, SONNET)
+    assert full["percent_label"]["text"] == "5.00% / 20M"
+    assert full["model_label"]["text"] == "Модель: Sonnet (×1.2)"
+    assert full["period_label"]["text"] == "Standard Tokens (за всё время)"
+    assert full["cache_progress_bar"]["width"] < full["progress_bar"]["width"]
+
+def test_progress_colour_and_bar_limit():
+    colours = [
+        build_view_state(MODE_COMPACT, int(MONTHLY_LIMIT * share), SONNET)["progress_bar"]["bg"]
+        for share in (0.5, 0.51, 0.81)
+    ]
+    assert colours == ["#238636", "#d29922", "#da3633"]
+    # Перерасход не растягивает полосу за её ширину
+    over = build_view_state(MODE_FULL, MONTHLY_LIMIT * 2, SONNET)
+    assert over["progress_bar"]["width"] == FULL_BAR_WIDTH
+    assert over["percent_label"]["text"] == "200.00% / 20M"
+
+def test_full_mode_texts():
+    state = build_view_state(
+        MODE_FULL, 0, SessionUsage(None, 0, 0, 0, 0),
+        window={"start": "2026-10-01"}, refresh={"state": REFRESH_PAUSED},
+    )
+    assert state["model_label"]["text"] == "Модель: ? (×1.0)"
+    assert state["period_label"]["text"] == "Standard Tokens (с 2026-10-01)"
+    # Без ST доля кэша не делится на ноль
+    assert state["cache_percent_label"]["text"] == "0.0% кэша (0 ST)"
+    assert state["metrics_label"]["text"] == "⏱ Скан ещё не выполнялся"
+    assert state["refresh_label"]["text"] == "🔄 Проверки на паузе — окно скрыто"
+    assert state["roots_label"]["text"] == ""
+    assert state["top_label"]["text"] == ""
+    
+    active = build_view_state(MODE_FULL, 0, SONNET, refresh={"state": REFRESH_ACTIVE, "interval_seconds": 0.5})
+    assert active["refresh_label"]["text"] == "🔄 Проверка раз в 0.50 с"
+
+def test_diff_of_same_state_is_empty():
+    state = build_view_state(MODE_FULL, 1_000_000, SONNET)
+    assert diff_view_state(state, build_view_state(MODE_FULL, 1_000_000, SONNET)) == {}
+
+def test_diff_keeps_only_changed_options():
+    rendered = build_view_state(MODE_COMPACT, 1_000_000, SONNET)
+    state = build_view_state(MODE_COMPACT, 1_000_001, SONNET)
+    # Ширина полосы и цвет те же — меняется только подпись итога
+    assert diff_view_state(rendered, state) == {"total_label": {"text": "1,000,001"}}
+    
+    state = build_view_state(MODE_COMPACT, MONTHLY_LIMIT, SessionUsage("gpt-5.1", 1, 0, 0, 0))
+    changes = diff_view_state(rendered, state)
+    assert set(changes) == {"total_label", "percent_label", "progress_bar", "model_label"}
+    assert changes["progress_bar"] == {"width": COMPACT_BAR_WIDTH, "bg": "#da3633"}
+    assert changes["model_label"] == {"text": "GPT"}
+
+def test_diff_against_nothing_rendered_sets_everything():
+    state = build_view_state(MODE_MINIATURE, 0, SONNET)
+    assert diff_view_state({}, state) == state
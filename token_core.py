@@ -0,0 +1,2559 @@
+import calendar
+import codecs
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
+import time
+import heapq
+
+from snapshot_file import SnapshotFileWriter
+
+# NumPy необязателен: без него итоги по колонкам считаются чистым Python.
+# Импорт стоит около 0.1 с, а окну он не нужен — грузится при первом подсчёте (load_numpy)
+numpy = None
+_numpy_loaded = False
+
+def load_numpy():
+    """Модуль numpy или None, если он не установлен; импортируется один раз"""
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+MODEL_MULTIPLIERS = {
+    "glm-4.6": 0.25,
+    "claude-haiku-4-5-20251001": 0.4,
+    "gpt-5.1": 0.5,
+    "gpt-5.1-codex": 0.5,
+    "gpt-5.1-codex-max": 0.5,
+    "gpt-5.2": 0.7,
+    "gemini-3-pro-preview": 0.8,
+    "claude-sonnet-4-5-20250929": 1.2,
+    "claude-opus-4-5-20251101": 2.0,
+    "claude-opus-4-1-20250805": 6.0,
+}
+
+MONTHLY_LIMIT = 20_000_000
+
+DEFAULT_SESSIONS_DIR = os.path.join(os.path.expanduser("~"), ".factory", "sessions")
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".token_widget_index.db")
+# Метрики сканов в формате Prometheus — для textfile-коллектора node exporter
+DEFAULT_METRICS_PATH = os.path.join(os.path.expanduser("~"), ".token_widget_metrics.prom")
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".token_history.json")
+# Процессов для разбора файлов при холодном скане (ключ scan_workers в конфиге)
+DEFAULT_SCAN_WORKERS = min(4, os.cpu_count() or 1)
+
+# Быстрое извлечение model и tokenUsage без построения всего дерева JSON
+SESSION_FIELDS = ("model", "tokenUsage")
+SESSION_HEAD_BYTES = 64 * 1024
+_JSON_DECODER = json.JSONDecoder()
+_WS_RE = re.compile(r"[ \t\n\r]*")
+# Участок внутри пропускаемого объекта или массива до следующей скобки:
+# строки поглощаются целиком, поэтому скобки внутри них не считаются
+_CONTAINER_RUN_RE = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+_CLOSING = {"{": "}", "[": "]"}
+
+def _skip_json_string(text, pos):
+    """Пропустить строку JSON без создания объекта; вернуть позицию после закрывающей кавычки"""
+    # Ищем кавычку, перед которой чётное число обратных слешей
+    end = pos
+    while True:
+        end = text.index('"', end + 1)
+        slash = end
+        while text[slash - 1] == "\\":
+            slash -= 1
+        if (end - slash) % 2 == 0:
+            return end + 1
+
+def _skip_json_value(text, pos):
+    """Пропустить значение JSON; вернуть позицию после него"""
+    char = text[pos]
+    if char == '"':
+        # Строки обычно самая тяжёлая часть нагрузки
+        return _skip_json_string(text, pos)
+    if char in _CLOSING:
+        # Объекты и массивы пропускаем по скобкам, ничего не декодируя: дерево
+        # служебных данных не строится даже на время. Содержимое между скобками
+        # не проверяется, строки и участки без скобок проходит регулярка в C.
+        # На плотных вложенных данных это в 2–4 раза медленнее C-декодера,
+        # зато пик памяти не растёт с размером служебных данных
+        expected = [_CLOSING[char]]
+        pos += 1
+        while expected:
+            pos = _CONTAINER_RUN_RE.match(text, pos).end()
+            # Обрыв документа даёт IndexError, как и у строк
+            char = text[pos]
+            if char in _CLOSING:
+                expected.append(_CLOSING[char])
+            elif char != expected.pop():
+                # Незакрытая строка или чужая скобка
+                raise ValueError("malformed container")
+            pos += 1
+        return pos
+    # Числа, true, false и null короткие — их разбирает C-декодер
+    return _JSON_DECODER.raw_decode(text, pos)[1]
+
+def extract_session_fields(text):
+    """Пройти ключи верхнего уровня и декодировать только SESSION_FIELDS"""
+    # Останавливаемся, как только все поля найдены. ValueError/IndexError означают,
+    # что документ битый или обрезан (например, передан только его начальный кусок)
+    found = {}
+    pos = _WS_RE.match(text, 0).end()
+    if text[pos] != "{":
+        raise ValueError("not an object")
+    pos = _WS_RE.match(text, pos + 1).end()
+    if text[pos] == "}":
+        return found
+    
+    while True:
+        if text[pos] != '"':
+            raise ValueError("expected key")
+        key, pos = json.decoder.scanstring(text, pos + 1)
+        pos = _WS_RE.match(text, pos).end()
+        if text[pos] != ":":
+            raise ValueError("expected ':'")
+        pos = _WS_RE.match(text, pos + 1).end()
+        
+        if key in SESSION_FIELDS:
+            found[key], pos = _JSON_DECODER.raw_decode(text, pos)
+            if len(found) == len(SESSION_FIELDS):
+                return found
+        else:
+            pos = _skip_json_value(text, pos)
+        
+        pos = _WS_RE.match(text, pos).end()
+        if text[pos] == "}":
+            return found
+        if text[pos] != ",":
+            raise ValueError("expected ',' or '}'")
+        pos = _WS_RE.match(text, pos + 1).end()
+
+def read_session_fields(session_file):
+    """Прочитать из файла сессии model и tokenUsage; при сбое — полный json.load
+    
+    Возвращает (model, tokenUsage, сколько байт прочитано с диска).
+    """
+    # Файл читается в байтах, чтобы метрика bytes_read была в байтах и для
+    # не-ASCII текста; символ, разрезанный границей начального куска, декодер
+    # придерживает до хвоста
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with open(session_file, "rb") as f:
+        chunk = f.read(SESSION_HEAD_BYTES)
+        bytes_read = len(chunk)
+        if bytes_read == SESSION_HEAD_BYTES:
+            # Обычно оба поля лежат в начале файла — хвост можно не читать
+            text = decoder.decode(chunk)
+            try:
+                found = extract_session_fields(text)
+                return found.get("model", "unknown"), found.get("tokenUsage", {}), bytes_read
+            except (ValueError, IndexError):
+                chunk = f.read()
+                bytes_read += len(chunk)
+                text += decoder.decode(chunk, final=True)
+        else:
+            text = decoder.decode(chunk, final=True)
+    
+    try:
+        found = extract_session_fields(text)
+    except (ValueError, IndexError):
+        data = json.loads(text)
+        return data.get("model", "unknown"), data.get("tokenUsage", {}), bytes_read
+    return found.get("model", "unknown"), found.get("tokenUsage", {}), bytes_read
+
+def scan_session_file(session_file):
+    """Разобрать файл сессии: (SessionUsage, прочитано байт, ошибка или None)"""
+    bytes_read = 0
+    try:
+        model, token_usage, bytes_read = read_session_fields(session_file)
+        
+        if not token_usage:
+            return EMPTY_USAGE, bytes_read, None
+        
+        # Имя модели у тысяч сессий одно и то же — храним одну строку на всех.
+        # null, число или список вместо имени считаем неизвестной моделью:
+        # множитель по такому ключу потом не посчитался бы
+        model = sys.intern(model) if isinstance(model, str) else "unknown"
+        usage = SessionUsage(
+            model,
+            int(token_usage.get("inputTokens", 0)),
+            int(token_usage.get("outputTokens", 0)),
+            int(token_usage.get("cacheCreationTokens", 0)),
+            int(token_usage.get("cacheReadTokens", 0)),
+        )
+        if not all(0 <= count <= COUNT_MAX for count in usage.counts()):
+            raise ValueError(f"token count out of range: {usage.counts()}")
+        return usage, bytes_read, None
+    except Exception as e:
+        # Битый или недописанный файл не должен ронять скан — он считается
+        # как пустая сессия, а причина уходит в метрики
+        return EMPTY_USAGE, bytes_read, f"{type(e).__name__}: {e}"
+
+def calculate_session_tokens(session_file):
+    """Рассчитать ST для одной сессии: (session_st, model, raw_data)"""
+    usage = scan_session_file(session_file)[0]
+    return usage.st, usage.model, usage.raw_data()
+
+def build_raw_data(model, input_tokens, output_tokens, cache_create, cache_read):
+    """Пересчитать сырые токены сессии в ST по множителю модели"""
+    usage = SessionUsage(model, input_tokens, output_tokens, cache_create, cache_read)
+    return usage.st, model, usage.raw_data()
+
+def parse_session_files(paths):
+    """Разобрать группу файлов сессий (один шард проекта) — выполняется в пуле процессов"""
+    return [scan_session_file(path) for path in paths]
+
+# Сырые счётчики сессии в порядке колонок SessionColumns
+SESSION_COUNT_FIELDS = ("input", "output", "cache_create", "cache_read")
+# Счётчик должен помещаться в колонку int64
+COUNT_MAX = (1 << 63) - 1
+
+class SessionUsage(namedtuple("SessionUsage", ("model",) + SESSION_COUNT_FIELDS)):
+    """Модель и сырые счётчики одной сессии; ST считаются из них по множителю модели
+    
+    Кортеж без __dict__ — вместо словаря raw_data на 8 ключей. model пустая
+    у сессии без tokenUsage.
+    """
+    __slots__ = ()
+    
+    @property
+    def multiplier(self):
+        return MODEL_MULTIPLIERS.get(self.model, 1.0) if self.model else 1.0
+    
+    @property
+    def input_st(self):
+        return int(self.input * self.multiplier)
+    
+    @property
+    def output_st(self):
+        return int(self.output * self.multiplier)
+    
+    @property
+    def cache_create_st(self):
+        return int(self.cache_create * self.multiplier / 10)
+    
+    @property
+    def cache_read_st(self):
+        return int(self.cache_read * self.multiplier / 10)
+    
+    @property
+    def st(self):
+        return self.input_st + self.output_st + self.cache_create_st + self.cache_read_st
+    
+    def counts(self):
+        return tuple(self[1:])
+    
+    def usage_values(self):
+        """Значения USAGE_VALUES сессии"""
+        return (self.st,) + self.counts()
+    
+    def raw_data(self):
+        """Разбивка в прежнем виде словаря (для JSON-вывода); пустая без tokenUsage"""
+        if self.model is None:
+            return {}
+        return {
+            "input": self.input,
+            "output": self.output,
+            "cache_create": self.cache_create,
+            "cache_read": self.cache_read,
+            "input_st": self.input_st,
+            "output_st": self.output_st,
+            "cache_create_st": self.cache_create_st,
+            "cache_read_st": self.cache_read_st,
+        }
+
+EMPTY_USAGE = SessionUsage(None, 0, 0, 0, 0)
+
+def aggregate_summary(by_model):
+    """Итог и доля кэша по суммам моделей: {"total_st", "cache_ratio", "by_model"}"""
+    total_st = sum(totals["st"] for totals in by_model.values())
+    cache_st = sum(totals["cache_create_st"] + totals["cache_read_st"] for totals in by_model.values())
+    return {
+        "total_st": total_st,
+        "cache_ratio": cache_st / total_st if total_st else 0.0,
+        "by_model": by_model,
+    }
+
+class SessionColumns:
+    """Сырые счётчики сессий по колонкам: int64 на каждое поле и int16-код модели
+    
+    Итоги, разбивка по моделям и доля кэша по всем сессиям считаются одним
+    векторным проходом — NumPy, если установлен, иначе чистый Python.
+    """
+    
+    # Код модели у сессии без tokenUsage и у освобождённой строки
+    NO_MODEL = -1
+    
+    def __init__(self):
+        self.columns = [array("q") for _ in SESSION_COUNT_FIELDS]
+        self.codes = array("h")
+        self.models = []
+        self.model_codes = {}
+        # Строки удалённых сессий переиспользуются
+        self.free = array("q")
+    
+    def model_code(self, model):
+        if model is None:
+            return self.NO_MODEL
+        code = self.model_codes.get(model)
+        if code is None:
+            code = self.model_codes[model] = len(self.models)
+            self.models.append(model)
+        return code
+    
+    def add(self, model, counts):
+        # array("q") проверяет диапазон до того, как выросла хоть одна колонка:
+        # иначе колонки разошлись бы по длине
+        counts = array("q", counts)
+        if self.free:
+            row = self.free[-1]
+            self.set(row, model, counts)
+            self.free.pop()
+            return row
+        row = len(self.codes)
+        self.codes.append(self.model_code(model))
+        for column, value in zip(self.columns, counts):
+            column.append(value)
+        return row
+    
+    def set(self, row, model, counts):
+        counts = array("q", counts)
+        self.codes[row] = self.model_code(model)
+        for column, value in zip(self.columns, counts):
+            column[row] = value
+    
+    def release(self, row):
+        self.set(row, None, (0,) * len(SESSION_COUNT_FIELDS))
+        self.free.append(row)
+    
+    def model(self, row):
+        code = self.codes[row]
+        return None if code == self.NO_MODEL else self.models[code]
+    
+    def counts(self, row):
+        return tuple(column[row] for column in self.columns)
+    
+    def aggregate(self):
+        """Итоги по всем сессиям: {"total_st", "cache_ratio", "by_model": {модель: суммы}}"""
+        if load_numpy() is not None:
+            per_model = self.aggregate_numpy()
+        else:
+            per_model = self.aggregate_python()
+        
+        by_model = {}
+        for code, (sessions, counts, st_values) in per_model.items():
+            totals = {"sessions": sessions}
+            for field, count, st in zip(SESSION_COUNT_FIELDS, counts, st_values):
+                totals[field] = count
+                totals[f"{field}_st"] = st
+            totals["st"] = sum(st_values)
+            by_model[self.models[code]] = totals
+        return aggregate_summary(by_model)
+    
+    def multipliers(self):
+        return [MODEL_MULTIPLIERS.get(model, 1.0) for model in self.models]
+    
+    def aggregate_numpy(self):
+        # frombuffer не копирует: колонки array читаются как есть. Код модели
+        # сдвигается на 1, чтобы NO_MODEL попал в корзину 0 с множителем 0
+        # и строки не пришлось фильтровать маской
+        width = len(self.models) + 1
+        if not self.codes:
+            return {}
+        bins = numpy.frombuffer(self.codes, dtype=numpy.int16).astype(numpy.intp) + 1
+        multiplier = numpy.asarray([0.0] + self.multipliers(), dtype=numpy.float64)[bins]
+        
+        sessions = numpy.bincount(bins, minlength=width)
+        counts = []
+        st_values = []
+        for field, column in zip(SESSION_COUNT_FIELDS, self.columns):
+            values = numpy.frombuffer(column, dtype=numpy.int64)
+            # Те же операции, что в build_raw_data: умножение, для кэша /10, отбрасывание дробной части
+            scaled = values * multiplier
+            if field.startswith("cache"):
+                scaled /= 10
+            numpy.trunc(scaled, out=scaled)
+            # bincount суммирует во float64 — точно для сумм меньше 2**53
+            counts.append(numpy.bincount(bins, weights=values, minlength=width))
+            st_values.append(numpy.bincount(bins, weights=scaled, minlength=width))
+        
+        return {
+            code - 1: (int(sessions[code]), [int(c[code]) for c in counts], [int(s[code]) for s in st_values])
+            for code in range(1, width) if sessions[code]
+        }
+    
+    def aggregate_python(self):
+        multipliers = self.multipliers()
+        per_model = {}
+        for row, code in enumerate(self.codes):
+            if code == self.NO_MODEL:
+                continue
+            entry = per_model.get(code)
+            if entry is None:
+                entry = per_model[code] = [0, [0] * len(SESSION_COUNT_FIELDS), [0] * len(SESSION_COUNT_FIELDS)]
+            entry[0] += 1
+            multiplier = multipliers[code]
+            for i, column in enumerate(self.columns):
+                value = column[row]
+                entry[1][i] += value
+                entry[2][i] += int(value * multiplier / 10) if i >= 2 else int(value * multiplier)
+        return {code: tuple(entry) for code, entry in per_model.items()}
+
+# Имя файла сессии — UUID: в кэше оно хранится двумя 64-битными числами.
+# Только каноническая запись (строчные hex-цифры) — чтобы имя восстанавливалось в точности
+_SESSION_NAME_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.settings\.json\Z")
+_UINT64_MASK = (1 << 64) - 1
+
+def split_session_name(name):
+    """(старшие, младшие 64 бита) UUID из имени файла сессии или None"""
+    if _SESSION_NAME_RE.match(name) is None:
+        return None
+    value = int(name[:36].replace("-", ""), 16)
+    return value >> 64, value & _UINT64_MASK
+
+def session_file_name(hi, lo):
+    digits = f"{hi:016x}{lo:016x}"
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}.settings.json"
+
+class SessionCache:
+    """Кэш результатов по файлам сессий: неизменённые файлы не перечитываются
+    
+    Сессии лежат таблицей из array, без Python-объекта на сессию. На строку —
+    mtime и размер (2×8 байт), счётчики и код модели в columns (4×8 + 2);
+    у каждого каталога проекта — отсортированные UUID имён файлов (2×8) и
+    номера их строк (4). Итого 70 байт на сессию плюс запас роста array;
+    путь собирается из каталога проекта и UUID. Файлы с именем не по шаблону
+    UUID держатся в обычном словаре. Замер — benchmarks/bench_memory.py.
+    """
+    
+    # mtime освобождённой строки: такая строка не бывает «последней»
+    FREE_MTIME = -(1 << 63)
+    
+    def __init__(self):
+        self.mtimes = array("q")
+        self.sizes = array("q")
+        self.columns = SessionColumns()
+        # По каталогу проекта: UUID файлов по возрастанию и их строки
+        self.project_dirs = []
+        self.project_ids = {}
+        self.his = []
+        self.los = []
+        self.orders = []
+        # Файлы с необычным именем: path -> строка
+        self.other = {}
+        self.count = 0
+        self.total = 0
+        # Изменения с последней записи в постоянный индекс
+        self.changed = set()
+        self.removed = set()
+        self.loaded = False
+        # Самая свежая по mtime сессия — её модель и разбивку показывает UI
+        self.latest_row = None
+    
+    def split_path(self, path):
+        """(каталог проекта, UUID) пути или None для имени не по шаблону"""
+        project_dir, sep, name = path.rpartition(os.sep)
+        key = split_session_name(name) if sep else None
+        if key is None:
+            return None
+        return (project_dir,) + key
+    
+    def search(self, project, hi, lo):
+        """Позиция UUID (hi, lo) в отсортированных ключах проекта"""
+        his = self.his[project]
+        los = self.los[project]
+        pos = bisect_left(his, hi)
+        # Совпадение старших 64 бит у разных UUID — редкость, дальше линейно
+        while pos < len(his) and his[pos] == hi and los[pos] < lo:
+            pos += 1
+        return pos
+    
+    def find(self, key):
+        """(проект, позиция, строка или None) для ключа из split_path"""
+        project_dir, hi, lo = key
+        project = self.project_ids.get(project_dir)
+        if project is None:
+            return None, 0, None
+        pos = self.search(project, hi, lo)
+        his = self.his[project]
+        if pos < len(his) and his[pos] == hi and self.los[project][pos] == lo:
+            return project, pos, self.orders[project][pos]
+        return project, pos, None
+    
+    def locate(self, path):
+        """Строка кэша с этим путём или None"""
+        key = self.split_path(path)
+        if key is None:
+            return self.other.get(path)
+        return self.find(key)[2]
+    
+    def paths(self):
+        """Все пути в кэше (собираются заново при каждом вызове)"""
+        for project, project_dir in enumerate(self.project_dirs):
+            prefix = project_dir + os.sep
+            for hi, lo in zip(self.his[project], self.los[project]):
+                yield prefix + session_file_name(hi, lo)
+        yield from self.other
+    
+    def directories(self):
+        """Каталоги проектов, в которых есть файлы кэша"""
+        dirs = {project_dir for project_dir, order in zip(self.project_dirs, self.orders) if order}
+        dirs.update(os.path.dirname(path) for path in self.other)
+        return dirs
+    
+    def project_files(self, project_dir, since_ns=None):
+        """(path, mtime_ns, size) файлов каталога проекта; since_ns — только изменённые не раньше"""
+        project = self.project_ids.get(project_dir)
+        if project is not None:
+            prefix = project_dir + os.sep
+            for hi, lo, row in zip(self.his[project], self.los[project], self.orders[project]):
+                # Путь собирается только для файлов, которые пройдут отбор
+                if since_ns is None or self.mtimes[row] >= since_ns:
+                    yield prefix + session_file_name(hi, lo), self.mtimes[row], self.sizes[row]
+        for path, row in self.other.items():
+            if os.path.dirname(path) == project_dir and (since_ns is None or self.mtimes[row] >= since_ns):
+                yield path, self.mtimes[row], self.sizes[row]
+    
+    def usage(self, row):
+        return SessionUsage(self.columns.model(row), *self.columns.counts(row))
+    
+    def get(self, path, mtime_ns, size):
+        """Строка кэша, если файл не менялся с прошлого скана, иначе None"""
+        row = self.locate(path)
+        if row is not None and self.mtimes[row] == mtime_ns and self.sizes[row] == size:
+            return row
+        return None
+    
+    def session(self, path):
+        """SessionUsage сессии из кэша или None"""
+        row = self.locate(path)
+        return None if row is None else self.usage(row)
+    
+    def store(self, path, mtime_ns, size, usage, keep_order=True):
+        """Записать результат файла, заняв новую строку при необходимости
+        
+        Без keep_order новые UUID дописываются в конец ключей проекта —
+        тогда вызывающий потом сортирует их сам (sort_projects).
+        """
+        key = self.split_path(path)
+        if key is None:
+            row = self.other.get(path)
+        elif keep_order:
+            project, pos, row = self.find(key)
+        else:
+            project, pos, row = self.project_ids.get(key[0]), None, None
+        
+        if row is not None:
+            old_st = self.usage(row).st
+            self.columns.set(row, usage.model, usage.counts())
+            self.total += usage.st - old_st
+            self.mtimes[row] = mtime_ns
+            self.sizes[row] = size
+            return row
+        
+        row = self.columns.add(usage.model, usage.counts())
+        if row == len(self.mtimes):
+            self.mtimes.append(mtime_ns)
+            self.sizes.append(size)
+        else:
+            self.mtimes[row] = mtime_ns
+            self.sizes[row] = size
+        self.count += 1
+        self.total += usage.st
+        
+        if key is None:
+            self.other[path] = row
+            return row
+        project_dir, hi, lo = key
+        if project is None:
+            project = self.project_ids[project_dir] = len(self.project_dirs)
+            self.project_dirs.append(project_dir)
+            self.his.append(array("Q"))
+            self.los.append(array("Q"))
+            self.orders.append(array("I"))
+        if pos is None:
+            pos = len(self.orders[project])
+        # Полный скан идёт по отсортированным путям — вставка обычно в конец
+        self.his[project].insert(pos, hi)
+        self.los[project].insert(pos, lo)
+        self.orders[project].insert(pos, row)
+        return row
+    
+    def sort_projects(self):
+        for project, order in enumerate(self.orders):
+            his = self.his[project]
+            los = self.los[project]
+            positions = sorted(range(len(order)), key=lambda pos: (his[pos], los[pos]))
+            self.his[project] = array("Q", [his[pos] for pos in positions])
+            self.los[project] = array("Q", [los[pos] for pos in positions])
+            self.orders[project] = array("I", [order[pos] for pos in positions])
+    
+    def put(self, path, mtime_ns, size, usage):
+        """Сохранить результат файла и обновить общую сумму на разницу"""
+        # mtime «последней» сессии — до записи: если это она же, store его перезапишет
+        latest_ns = None if self.latest_row is None else self.mtimes[self.latest_row]
+        row = self.store(path, mtime_ns, size, usage)
+        self.changed.add(path)
+        self.removed.discard(path)
+        
+        if latest_ns is None or mtime_ns >= latest_ns:
+            self.latest_row = row
+        elif self.latest_row == row:
+            self.find_latest()
+        return row
+    
+    def remove(self, path):
+        """Убрать вклад удалённого файла; вернуть (mtime_ns, SessionUsage) его записи или None, если её не было"""
+        key = self.split_path(path)
+        if key is None:
+            row = self.other.pop(path, None)
+        else:
+            project, pos, row = self.find(key)
+            if row is not None:
+                del self.his[project][pos]
+                del self.los[project][pos]
+                del self.orders[project][pos]
+        if row is None:
+            return None
+        usage = self.usage(row)
+        mtime_ns = self.mtimes[row]
+        self.total -= usage.st
+        self.mtimes[row] = self.FREE_MTIME
+        self.columns.release(row)
+        self.count -= 1
+        self.changed.discard(path)
+        self.removed.add(path)
+        if self.latest_row == row:
+            self.find_latest()
+        return mtime_ns, usage
+    
+    def prune(self, seen):
+        """Удалить записи всех файлов, которых не было в последнем скане; {path: (mtime_ns, SessionUsage)} удалённых"""
+        return {path: self.remove(path) for path in [path for path in self.paths() if path not in seen]}
+    
+    def load(self, rows):
+        """Заполнить кэш строками постоянного индекса без пометки изменений
+        
+        rows — (path, mtime_ns, size, model, input, output, cache_create, cache_read, session_st).
+        """
+        # В пустой кэш строки кладутся подряд, а ключи проектов сортируются один раз в конце
+        bulk = not self.count
+        for path, mtime_ns, size, model, *counts, session_st in rows:
+            self.store(path, mtime_ns, size, SessionUsage(model, *counts), keep_order=not bulk)
+        if bulk:
+            self.sort_projects()
+        self.loaded = True
+        self.find_latest()
+    
+    def find_latest(self):
+        """Найти самую свежую сессию полным проходом по кэшу (без I/O)"""
+        if not self.count:
+            self.latest_row = None
+            return
+        self.latest_row = max(range(len(self.mtimes)), key=self.mtimes.__getitem__)
+    
+    def latest(self):
+        """SessionUsage самой свежей сессии"""
+        if self.latest_row is None:
+            return EMPTY_USAGE
+        return self.usage(self.latest_row)
+    
+    def latest_mtime(self):
+        return None if self.latest_row is None else self.mtimes[self.latest_row]
+    
+    def drain_changes(self):
+        """Изменённые (строками индекса) и удалённые с прошлого вызова пути"""
+        changed = []
+        for path in self.changed:
+            row = self.locate(path)
+            usage = self.usage(row)
+            changed.append((path, self.mtimes[row], self.sizes[row]) + tuple(usage) + (usage.st,))
+        removed = list(self.removed)
+        self.changed.clear()
+        self.removed.clear()
+        return changed, removed
+
+# Гранулярности сводок расхода и что в них суммируется
+USAGE_HOUR = 0
+USAGE_DAY = 1
+USAGE_MONTH = 2
+USAGE_LEVELS = ("hour", "day", "month")
+USAGE_VALUES = ("st", "input", "output", "cache_create", "cache_read")
+# Разбивки расхода в снимке (SessionScanner.breakdowns)
+BREAKDOWN_KEYS = ("model", "project")
+
+def add_group_deltas(groups, key, deltas):
+    sums = groups.get(key)
+    if sums is None:
+        sums = groups[key] = [0] * len(USAGE_VALUES)
+    for i, delta in enumerate(deltas):
+        sums[i] += delta
+
+def top_groups(groups, n=None):
+    """Группы разбивки {имя: {USAGE_VALUES}} по убыванию ST: [(имя, значения)], n — сколько первых"""
+    key = lambda item: item[1]["st"]
+    if n is None:
+        return sorted(groups.items(), key=key, reverse=True)
+    return heapq.nlargest(n, groups.items(), key=key)
+
+def usage_buckets(timestamp):
+    """Номера часа, дня и месяца (по местному времени) для момента timestamp"""
+    moment = datetime.fromtimestamp(timestamp)
+    day = moment.toordinal()
+    return day * 24 + moment.hour, day, moment.year * 12 + moment.month - 1
+
+def usage_bucket_label(level, bucket):
+    if level == USAGE_HOUR:
+        return f"{date.fromordinal(bucket // 24).isoformat()} {bucket % 24:02d}:00"
+    if level == USAGE_DAY:
+        return date.fromordinal(bucket).isoformat()
+    return f"{bucket // 12:04d}-{bucket % 12 + 1:02d}"
+
+BILLING_MONTHLY = "monthly"
+BILLING_NEVER = "never"
+BILLING_POLICIES = (BILLING_MONTHLY, BILLING_NEVER)
+
+class BillingWindow:
+    """Расчётный период лимита: с дня start_day месяца до того же дня следующего
+    
+    При policy=BILLING_NEVER периода нет и лимит считается от всего расхода.
+    Если в месяце меньше дней, чем start_day, период начинается в его последний день.
+    """
+    
+    def __init__(self, start_day=1, policy=BILLING_MONTHLY):
+        self.start_day = min(max(1, int(start_day)), 31)
+        self.policy = policy if policy in BILLING_POLICIES else BILLING_MONTHLY
+    
+    def period_start(self, year, month):
+        return date(year, month, min(self.start_day, calendar.monthrange(year, month)[1]))
+    
+    def bounds(self, today=None):
+        """(первый день, день после последнего) текущего периода или None"""
+        if self.policy == BILLING_NEVER:
+            return None
+        today = today or date.today()
+        year, month = today.year, today.month
+        start = self.period_start(year, month)
+        if start > today:
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+            start = self.period_start(year, month)
+        next_year, next_month = (year, month + 1) if month < 12 else (year + 1, 1)
+        return start, self.period_start(next_year, next_month)
+    
+    def seconds_left(self):
+        """Секунд до начала следующего периода (None — сброса нет)"""
+        bounds = self.bounds()
+        if bounds is None:
+            return None
+        end = datetime(bounds[1].year, bounds[1].month, bounds[1].day)
+        return max(1.0, (end - datetime.now()).total_seconds())
+
+class UsageTable:
+    """Сводки одной гранулярности: строка на (bucket, model, project), значения — колонки array('q')"""
+    
+    def __init__(self):
+        self.clear()
+    
+    def clear(self):
+        # (bucket, model_id, project_id) -> номер строки
+        self.rows = {}
+        self.buckets = array("q")
+        self.models = array("l")
+        self.projects = array("l")
+        self.values = [array("q") for _ in USAGE_VALUES]
+        self.dirty = set()
+    
+    def add(self, key, deltas):
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.buckets)
+            self.buckets.append(key[0])
+            self.models.append(key[1])
+            self.projects.append(key[2])
+            for column in self.values:
+                column.append(0)
+        for column, delta in zip(self.values, deltas):
+            column[row] += delta
+        self.dirty.add(row)
+    
+    def row_values(self, row):
+        return tuple(column[row] for column in self.values)
+    
+    def drain_changes(self):
+        """Изменённые строки: (bucket, model_id, project_id, *значения)"""
+        rows = [(self.buckets[row], self.models[row], self.projects[row]) + self.row_values(row) for row in self.dirty]
+        self.dirty.clear()
+        return rows
+    
+    def prune(self, before):
+        """Удалить строки старше bucket before, вернуть их ключи"""
+        removed = [key for key in self.rows if key[0] < before]
+        if not removed:
+            return []
+        # Колонки пересобираются без удалённых строк; незаписанные изменения сохраняются
+        kept = [(key, self.row_values(row), row in self.dirty) for key, row in self.rows.items() if key[0] >= before]
+        self.clear()
+        for key, values, dirty in kept:
+            self.add(key, values)
+            if not dirty:
+                self.dirty.discard(self.rows[key])
+        return removed
+
+class UsageStore:
+    """Расход по часам, дням и месяцам с разбивкой по модели и проекту
+    
+    Пополняется разницей между прежним и новым состоянием сессии, отнесённой
+    к mtime файла, поэтому запросы по периодам не перечитывают файлы сессий.
+    Прежнее состояние — запись сессии в постоянном индексе; у удалённой сессии
+    её расход вычитается в час её последнего изменения.
+    Почасовые сводки хранятся HOURLY_RETENTION_DAYS дней, дневные и месячные — всегда.
+    """
+    
+    HOURLY_RETENTION_DAYS = 92
+    
+    def __init__(self):
+        # Имена моделей и проектов хранятся один раз, в таблицах — их номера
+        self.names = []
+        self.name_ids = {}
+        self.new_names = []
+        self.tables = [UsageTable() for _ in USAGE_LEVELS]
+        self.removed = []
+        self.pruned_day = None
+        # Текущий расчётный период [start, end) в днях и расход внутри него
+        self.window = None
+        self.window_total = 0
+        # Расход по моделям и проектам за всё время и за период:
+        # {by: {имя: [USAGE_VALUES]}}, пополняется в record без обхода таблиц
+        self.all_groups = {by: {} for by in BREAKDOWN_KEYS}
+        self.window_groups = {by: {} for by in BREAKDOWN_KEYS}
+    
+    def intern(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            self.new_names.append((name_id, name))
+        return name_id
+    
+    def record(self, timestamp, model, project, deltas):
+        """Добавить прирост расхода сессии во все гранулярности"""
+        model_id = self.intern(model)
+        project_id = self.intern(project)
+        buckets = usage_buckets(timestamp)
+        for table, bucket in zip(self.tables, buckets):
+            table.add((bucket, model_id, project_id), deltas)
+        in_window = self.window is not None and self.window[0] <= buckets[USAGE_DAY] < self.window[1]
+        if in_window:
+            self.window_total += deltas[0]
+        for by, name in zip(BREAKDOWN_KEYS, (model, project)):
+            add_group_deltas(self.all_groups[by], name, deltas)
+            if in_window:
+                add_group_deltas(self.window_groups[by], name, deltas)
+    
+    def set_window(self, start, end):
+        """Сменить расчётный период; расход пересчитывается по дневным сводкам только при смене"""
+        if (start, end) == self.window:
+            return False
+        self.window = (start, end)
+        self.window_total = self.totals(USAGE_DAY, start, end).get(None, [0])[0]
+        self.window_groups = {by: self.totals(USAGE_DAY, start, end, by=by) for by in BREAKDOWN_KEYS}
+        return True
+    
+    def load(self, names, rows):
+        """Заполнить из постоянного индекса: names — (id, name), rows — (level, bucket, model, project, *значения)"""
+        for name_id, name in sorted(names):
+            self.name_ids[name] = name_id
+            self.names.append(name)
+        for level, bucket, model_id, project_id, *values in rows:
+            self.tables[level].add((bucket, model_id, project_id), values)
+        for table in self.tables:
+            table.dirty.clear()
+        self.all_groups = {by: self.totals(USAGE_MONTH, by=by) for by in BREAKDOWN_KEYS}
+        # Расход периода пересчитается при следующем set_window
+        self.window = None
+    
+    def is_empty(self):
+        return not any(table.rows for table in self.tables)
+    
+    def breakdown(self, by, window=True):
+        """{имя: [USAGE_VALUES]} по модели или проекту: за расчётный период (если он задан) или за всё время
+        
+        Это живые суммы, которые меняет record, — снаружи потока сканера их надо копировать.
+        """
+        groups = self.window_groups if window and self.window is not None else self.all_groups
+        return groups[by]
+    
+    def prune_hourly(self, today):
+        if self.pruned_day == today:
+            return
+        self.pruned_day = today
+        before = (today - self.HOURLY_RETENTION_DAYS) * 24
+        self.removed.extend((USAGE_HOUR,) + key for key in self.tables[USAGE_HOUR].prune(before))
+    
+    def drain_changes(self):
+        """Новые имена, изменённые строки и удалённые ключи — для записи в индекс"""
+        self.prune_hourly(date.today().toordinal())
+        names = self.new_names
+        rows = [(level,) + row for level, table in enumerate(self.tables) for row in table.drain_changes()]
+        removed = self.removed
+        self.new_names = []
+        self.removed = []
+        return names, rows, removed
+    
+    def totals(self, level, start=None, end=None, by=None):
+        """Суммы USAGE_VALUES за bucket в [start, end), сгруппированные по by
+        
+        by: None — одна сумма, "model", "project" или "bucket".
+        """
+        table = self.tables[level]
+        group_columns = {"model": table.models, "project": table.projects, "bucket": table.buckets}
+        groups = {}
+        for row in range(len(table.buckets)):
+            bucket = table.buckets[row]
+            if (start is not None and bucket < start) or (end is not None and bucket >= end):
+                continue
+            if by is None:
+                key = None
+            elif by == "bucket":
+                key = bucket
+            else:
+                key = self.names[group_columns[by][row]]
+            sums = groups.get(key)
+            if sums is None:
+                sums = groups[key] = [0] * len(USAGE_VALUES)
+            for i, column in enumerate(table.values):
+                sums[i] += column[row]
+        return groups
+
+class SessionIndex:
+    """Постоянный индекс сессий в SQLite, чтобы старт не пересканировал всё дерево"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+    
+    def open(self):
+        """Открыть (или создать) базу индекса"""
+        try:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, model TEXT, "
+                "input INTEGER, output INTEGER, cache_create INTEGER, cache_read INTEGER, st INTEGER)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_mtime ON sessions (mtime_ns)")
+            # Сводки UsageStore: level — USAGE_HOUR/DAY/MONTH, model и project — номера из usage_names
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "level INTEGER, bucket INTEGER, model INTEGER, project INTEGER, "
+                "st INTEGER, input INTEGER, output INTEGER, cache_create INTEGER, cache_read INTEGER, "
+                "PRIMARY KEY (level, bucket, model, project)) WITHOUT ROWID"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS usage_names (id INTEGER PRIMARY KEY, name TEXT)")
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Ошибка открытия индекса сессий: {e}")
+            self.close()
+            return False
+    
+    def summary(self):
+        """Сумма ST и последняя по mtime сессия (mtime_ns, model, счётчики) — без чтения всех строк"""
+        if self.conn is None:
+            return None
+        try:
+            count, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(st), 0) FROM sessions").fetchone()
+            if not count:
+                return None
+            latest = self.conn.execute(
+                "SELECT mtime_ns, model, input, output, cache_create, cache_read FROM sessions "
+                "ORDER BY mtime_ns DESC LIMIT 1"
+            ).fetchone()
+            return total, latest
+        except sqlite3.Error:
+            return None
+    
+    def rows(self):
+        """Все записи индекса: (path, mtime_ns, size, model, input, output, cache_create, cache_read, st)"""
+        if self.conn is None:
+            return []
+        try:
+            return self.conn.execute(
+                "SELECT path, mtime_ns, size, model, input, output, cache_create, cache_read, st FROM sessions"
+            ).fetchall()
+        except sqlite3.Error:
+            return []
+    
+    def usage(self):
+        """Сохранённые сводки расхода: ([(id, name)], [(level, bucket, model, project, *значения)])"""
+        if self.conn is None:
+            return [], []
+        try:
+            names = self.conn.execute("SELECT id, name FROM usage_names").fetchall()
+            rows = self.conn.execute(
+                "SELECT level, bucket, model, project, st, input, output, cache_create, cache_read FROM usage"
+            ).fetchall()
+            return names, rows
+        except sqlite3.Error:
+            return [], []
+    
+    def window_total(self, start, end):
+        """Расход ST за дни [start, end) из дневных сводок — для первого кадра до скана"""
+        if self.conn is None:
+            return 0
+        try:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(st), 0) FROM usage WHERE level = ? AND bucket >= ? AND bucket < ?",
+                (USAGE_DAY, start, end),
+            ).fetchone()[0]
+        except sqlite3.Error:
+            return 0
+    
+    def apply(self, changed, removed, usage=None):
+        """Записать изменения кэша и сводок расхода одной транзакцией"""
+        # Сводки пишутся вместе с сессиями: после сбоя они не разойдутся с индексом,
+        # и прирост при следующем скане не посчитается дважды
+        names, usage_rows, usage_removed = usage or ((), (), ())
+        if self.conn is None or not (changed or removed or names or usage_rows or usage_removed):
+            return
+        try:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO usage_names VALUES (?, ?)", names)
+                self.conn.executemany("INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", usage_rows)
+                self.conn.executemany(
+                    "DELETE FROM usage WHERE level = ? AND bucket = ? AND model = ? AND project = ?", usage_removed
+                )
+                self.conn.executemany("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", changed)
+                self.conn.executemany("DELETE FROM sessions WHERE path = ?", [(path,) for path in removed])
+        except sqlite3.Error as e:
+            print(f"Ошибка записи индекса сессий: {e}")
+    
+    def close(self):
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        except sqlite3.Error:
+            pass
+        self.conn = None
+
+class InotifyWatcher:
+    """Наблюдение за каталогом сессий через inotify (Linux)"""
+    
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    
+    ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+    # IN_MODIFY не слушаем: файл, пойманный посреди записи, всё равно придёт с IN_CLOSE_WRITE
+    PROJECT_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    EVENT_HEADER = struct.Struct("iIII")
+    
+    def __init__(self, sessions_dir, notify=None):
+        self.sessions_dir = sessions_dir
+        self.notify = notify
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wake_r, self.wake_w = os.pipe()
+        self.watches = {}
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.full_rescan = False
+        self.running = False
+        self.thread = None
+        
+        self.add_watch(sessions_dir, self.ROOT_MASK)
+        for project_dir in os.listdir(sessions_dir):
+            project_path = os.path.join(sessions_dir, project_dir)
+            if os.path.isdir(project_path):
+                self.add_watch(project_path, self.PROJECT_MASK)
+    
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        self.watches[wd] = path
+    
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def is_alive(self):
+        return self.running
+    
+    def run(self):
+        try:
+            while self.running:
+                readable, _, _ = select.select([self.fd, self.wake_r], [], [])
+                if self.wake_r in readable:
+                    break
+                try:
+                    buf = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self.handle_events(buf)
+                if self.notify and (self.changed or self.full_rescan):
+                    self.notify()
+        except OSError as e:
+            print(f"Ошибка наблюдения за сессиями: {e}")
+            with self.lock:
+                self.full_rescan = True
+        finally:
+            self.running = False
+            os.close(self.fd)
+            os.close(self.wake_r)
+            if self.notify:
+                self.notify()
+    
+    def handle_events(self, buf):
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(buf, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            
+            if mask & self.IN_Q_OVERFLOW:
+                with self.lock:
+                    self.full_rescan = True
+                continue
+            
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & self.IN_IGNORED:
+                del self.watches[wd]
+                continue
+            
+            if dir_path == self.sessions_dir:
+                if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    # Каталог сессий пропал — дальше следить нечем
+                    with self.lock:
+                        self.full_rescan = True
+                    self.running = False
+                    return
+                if not mask & self.IN_ISDIR:
+                    continue
+                project_path = os.path.join(dir_path, name)
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # Новый проект: ставим наблюдение и отдаём все уже лежащие в нём файлы
+                    try:
+                        self.add_watch(project_path, self.PROJECT_MASK)
+                        files = [os.path.join(project_path, f) for f in os.listdir(project_path)]
+                    except OSError:
+                        files = []
+                    with self.lock:
+                        self.changed.update(files)
+                else:
+                    # Проект удалён целиком — проще пересканировать дерево
+                    with self.lock:
+                        self.full_rescan = True
+            elif name.endswith(".settings.json"):
+                with self.lock:
+                    self.changed.add(os.path.join(dir_path, name))
+    
+    def drain(self):
+        """Забрать накопленные изменения: (пути файлов, нужен ли полный скан)"""
+        with self.lock:
+            changed, full_rescan = self.changed, self.full_rescan
+            self.changed = set()
+            self.full_rescan = False
+        return changed, full_rescan
+    
+    def poll_due(self):
+        # Изменения приходят событиями — обходить дерево не нужно
+        return False
+    
+    def stop(self):
+        if self.running:
+            self.running = False
+            try:
+                os.write(self.wake_w, b"x")
+            except OSError:
+                pass
+            if self.thread:
+                self.thread.join(timeout=1)
+        try:
+            os.close(self.wake_w)
+        except OSError:
+            pass
+
+class SessionTreeWalker:
+    """Обход дерева сессий через os.scandir с отсечением неизменённых каталогов проектов
+    
+    Своего списка файлов обходчик не держит: известные mtime и размеры файлов
+    берутся из строк SessionCache, а сам он помнит только mtime каталогов проектов.
+    """
+    
+    # Файлы, менявшиеся за это время, перепроверяются даже в неизменённом каталоге
+    HOT_SECONDS = 24 * 3600
+    # Правка «холодного» файла на месте не меняет mtime каталога — раз в минуту проверяем всё
+    FULL_CHECK_SECONDS = 60
+    
+    def __init__(self, sessions_dir, cache):
+        self.sessions_dir = sessions_dir
+        self.cache = cache
+        # project_path -> mtime_ns каталога на последнем обходе
+        self.dir_mtimes = {}
+        self.last_full_check = None
+    
+    def walk(self, stop_event=None):
+        """Вернуть [(file_path, mtime_ns, size)] всех файлов сессий, прочитав каждый каталог
+        
+        None — обход прерван или каталог сессий недоступен (не смонтирован, нет прав):
+        пустой результат означал бы, что все сессии удалены.
+        """
+        projects = self.project_dirs()
+        if projects is None:
+            return None
+        files = []
+        dir_mtimes = {}
+        for project_path, dir_mtime_ns in projects:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            project_files = self.list_project(project_path)
+            if project_files is None:
+                # Каталог временно недоступен — оставляем то, что знали о нём
+                dir_mtime_ns = self.dir_mtimes.get(project_path)
+                project_files = list(self.cache.project_files(project_path))
+            dir_mtimes[project_path] = dir_mtime_ns
+            files.extend(project_files)
+        self.dir_mtimes = dir_mtimes
+        self.last_full_check = time.monotonic()
+        return files
+    
+    def changes(self, stop_event=None):
+        """Пути файлов, которые отличаются от кэша: новые, изменённые и пропавшие; None — как у walk
+        
+        Каталог проекта с прежним mtime не читается: в нём перепроверяются только
+        «горячие» файлы, а раз в FULL_CHECK_SECONDS — все каталоги.
+        """
+        now = time.monotonic()
+        full = self.last_full_check is None or now - self.last_full_check >= self.FULL_CHECK_SECONDS
+        hot_since_ns = time.time_ns() - self.HOT_SECONDS * 1_000_000_000
+        
+        projects = self.project_dirs()
+        if projects is None:
+            return None
+        changed = set()
+        dir_mtimes = {}
+        for project_path, dir_mtime_ns in projects:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            known = self.dir_mtimes.get(project_path)
+            if known == dir_mtime_ns and not full:
+                # Состав каталога не менялся — перепроверяем только «горячие» файлы
+                changed.update(self.changed_hot(project_path, hot_since_ns))
+            else:
+                project_files = self.list_project(project_path)
+                if project_files is None:
+                    # Каталог временно недоступен — его файлы не считаем ни изменёнными, ни удалёнными
+                    dir_mtime_ns = known
+                else:
+                    changed.update(self.changed_listed(project_path, project_files))
+            dir_mtimes[project_path] = dir_mtime_ns
+        
+        # Каталог проекта удалён целиком
+        for project_path in self.cache.directories() - dir_mtimes.keys():
+            changed.update(path for path, _, _ in self.cache.project_files(project_path))
+        self.dir_mtimes = dir_mtimes
+        if full:
+            self.last_full_check = now
+        return changed
+    
+    def project_dirs(self):
+        """[(project_path, mtime_ns)] каталогов проектов или None, если корень не читается"""
+        projects = []
+        try:
+            with os.scandir(self.sessions_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            projects.append((entry.path, entry.stat().st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        return projects
+    
+    def list_project(self, project_path):
+        """Прочитать каталог проекта; stat берётся из DirEntry без лишних вызовов"""
+        project_files = []
+        try:
+            with os.scandir(project_path) as it:
+                for entry in it:
+                    if entry.name.endswith(".settings.json"):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        project_files.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            return None
+        return project_files
+    
+    def changed_listed(self, project_path, project_files):
+        """Изменённые и новые файлы прочитанного каталога и пропавшие из него"""
+        seen = set()
+        for file_path, mtime_ns, size in project_files:
+            seen.add(file_path)
+            if self.cache.get(file_path, mtime_ns, size) is None:
+                yield file_path
+        for file_path, _, _ in self.cache.project_files(project_path):
+            if file_path not in seen:
+                yield file_path
+    
+    def changed_hot(self, project_path, hot_since_ns):
+        for file_path, mtime_ns, size in self.cache.project_files(project_path, hot_since_ns):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                yield file_path
+                continue
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+                yield file_path
+
+# Состояния RefreshScheduler: events — изменения приходят от inotify и интервал не нужен
+REFRESH_ACTIVE = "active"
+REFRESH_EVENTS = "events"
+REFRESH_IDLE = "idle"
+REFRESH_PAUSED = "paused"
+REFRESH_STATES = (REFRESH_ACTIVE, REFRESH_EVENTS, REFRESH_IDLE, REFRESH_PAUSED)
+
+class RefreshScheduler:
+    """Интервал проверки сессий: min_seconds, пока они меняются, в простое — откат в backoff раз до max_seconds
+    
+    На паузе (окно скрыто) проверки не идут вовсе; resume() сразу будит ждущих.
+    """
+    
+    DEFAULTS = {"min_seconds": 0.25, "max_seconds": 120.0, "backoff": 2.0}
+    
+    def __init__(self, min_seconds=0.25, max_seconds=120.0, backoff=2.0):
+        self.min_seconds = max(0.05, float(min_seconds))
+        self.max_seconds = max(self.min_seconds, float(max_seconds))
+        self.backoff = max(1.0, float(backoff))
+        self.interval = self.min_seconds
+        self.paused = False
+        self.event_driven = False
+        self.changes = 0
+        self.checks = 0
+        self.last_change = None
+        # Поколение растёт на каждом kick/resume — так будятся все ждущие сразу
+        self.generation = 0
+        self.condition = threading.Condition()
+    
+    @classmethod
+    def from_config(cls, config):
+        """Из словаря конфига (ключи DEFAULTS); неверные значения заменяются умолчаниями"""
+        settings = dict(cls.DEFAULTS)
+        for key, value in (config or {}).items():
+            if key in settings and isinstance(value, (int, float)) and value > 0:
+                settings[key] = value
+        return cls(**settings)
+    
+    def policy(self):
+        return {"min_seconds": self.min_seconds, "max_seconds": self.max_seconds, "backoff": self.backoff}
+    
+    def activity(self):
+        """Сессии менялись — проверять чаще"""
+        with self.condition:
+            self.interval = self.min_seconds
+            self.changes += 1
+            self.checks += 1
+            self.last_change = time.time()
+    
+    def idle(self):
+        """Проверка без изменений — отодвинуть следующую"""
+        with self.condition:
+            self.interval = min(self.interval * self.backoff, self.max_seconds)
+            self.checks += 1
+    
+    def pause(self):
+        with self.condition:
+            self.paused = True
+    
+    def resume(self):
+        with self.condition:
+            if self.paused:
+                self.paused = False
+                self.interval = self.min_seconds
+                self.generation += 1
+                self.condition.notify_all()
+    
+    def kick(self):
+        """Разбудить ждущих (например, при остановке)"""
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+    
+    def wait(self, stop_event):
+        """Дождаться следующей проверки; False — пора остановиться"""
+        with self.condition:
+            while not stop_event.is_set():
+                generation = self.generation
+                self.condition.wait_for(lambda: self.generation != generation, None if self.paused else self.interval)
+                if stop_event.is_set():
+                    break
+                if not self.paused:
+                    # Истёк интервал или сняли паузу — проверяем сейчас
+                    return True
+            return False
+    
+    def state(self):
+        if self.paused:
+            return REFRESH_PAUSED
+        if self.event_driven:
+            return REFRESH_EVENTS
+        return REFRESH_ACTIVE if self.interval <= self.min_seconds else REFRESH_IDLE
+    
+    def as_dict(self):
+        with self.condition:
+            return {
+                "state": self.state(),
+                "interval_seconds": self.interval,
+                **self.policy(),
+                "changes": self.changes,
+                "checks": self.checks,
+                "last_change": self.last_change,
+            }
+
+def merge_refresh_states(states):
+    """Сложить RefreshScheduler.as_dict нескольких корней: самый частый интервал и самое активное состояние"""
+    if not states:
+        return None
+    merged = dict(min(states, key=lambda data: (REFRESH_STATES.index(data["state"]), data["interval_seconds"])))
+    merged["changes"] = sum(data["changes"] for data in states)
+    merged["checks"] = sum(data["checks"] for data in states)
+    merged["last_change"] = max((data["last_change"] for data in states if data["last_change"]), default=None)
+    return merged
+
+class PollingWatcher:
+    """Переносимый запасной вариант: будит сканер для обхода дерева с интервалом от RefreshScheduler
+    
+    Обход и сравнение с кэшем делает поток сканера (SessionTreeWalker.changes),
+    он же сообщает планировщику, были ли изменения, — своего списка файлов
+    у наблюдателя нет.
+    """
+    
+    def __init__(self, sessions_dir, notify=None, scheduler=None):
+        self.sessions_dir = sessions_dir
+        self.scheduler = scheduler or RefreshScheduler()
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.due = False
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def is_alive(self):
+        return not self.stop_event.is_set()
+    
+    def run(self):
+        while self.scheduler.wait(self.stop_event):
+            with self.lock:
+                self.due = True
+            if self.notify:
+                self.notify()
+    
+    def drain(self):
+        """Забрать накопленные изменения: (пути файлов, нужен ли полный скан)"""
+        return set(), False
+    
+    def poll_due(self):
+        """Пора ли обойти дерево (флаг сбрасывается)"""
+        with self.lock:
+            due = self.due
+            self.due = False
+        return due
+    
+    def stop(self):
+        self.stop_event.set()
+        self.scheduler.kick()
+        if self.thread:
+            self.thread.join(timeout=1)
+
+def create_session_watcher(sessions_dir, notify=None, scheduler=None):
+    """inotify на Linux, иначе опрос stat с интервалом от scheduler"""
+    if sys.platform.startswith("linux") and os.path.isdir(sessions_dir):
+        try:
+            return InotifyWatcher(sessions_dir, notify=notify)
+        except (OSError, AttributeError) as e:
+            print(f"inotify недоступен, используем опрос: {e}")
+    return PollingWatcher(sessions_dir, notify=notify, scheduler=scheduler)
+
+# Неизменяемый результат скана, который фоновый поток передаёт в UI;
+# usage — SessionUsage самой свежей сессии, latest_ns — mtime её файла,
+# metrics — счётчики скана, на котором он получен (ScanMetrics.as_dict),
+# window — расчётный период и расход в нём (None, если лимит без сброса),
+# roots — разбивка по каталогам сессий (только у снимка MultiRootScanner),
+# breakdowns — ST по моделям и проектам за период (если сканер их считает)
+SessionSnapshot = namedtuple(
+    "SessionSnapshot", ["total", "usage", "metrics", "window", "latest_ns", "roots", "breakdowns"],
+    defaults=(None, None, None, None, None),
+)
+
+# Во что обошёлся один скан
+SCAN_METRIC_FIELDS = ("scan_seconds", "files_stated", "files_parsed", "cache_hits", "parse_failures", "bytes_read", "files_deferred")
+
+SCAN_METRIC_HELP = {
+    "scan_seconds": "Wall time of session scans",
+    "files_stated": "Session files stat'ed",
+    "files_parsed": "Session files read and parsed",
+    "cache_hits": "Session files skipped because mtime and size were unchanged",
+    "parse_failures": "Session files that could not be parsed",
+    "bytes_read": "Bytes read from session files",
+    "files_deferred": "New session files older than the billing window, parsed after the window snapshot",
+}
+
+class ScanMetrics:
+    """Счётчики последнего скана и накопленные итоги — для UI и файла метрик"""
+    
+    def __init__(self):
+        self.current = None
+        self.started = 0.0
+        self.last = dict.fromkeys(SCAN_METRIC_FIELDS, 0)
+        self.totals = dict.fromkeys(SCAN_METRIC_FIELDS, 0)
+        self.scans = 0
+        self.errors = 0
+        self.last_error = None
+        # Состояние RefreshScheduler сканера на момент снимка (RefreshScheduler.as_dict)
+        self.refresh = None
+    
+    def begin(self):
+        self.current = dict.fromkeys(SCAN_METRIC_FIELDS, 0)
+        self.started = time.perf_counter()
+    
+    def add(self, field, count=1):
+        self.current[field] += count
+    
+    def record_parse(self, bytes_read, error):
+        self.current["files_parsed"] += 1
+        self.current["bytes_read"] += bytes_read
+        if error is not None:
+            self.current["parse_failures"] += 1
+            self.last_error = error
+    
+    def record_error(self, error):
+        """Сбой всего скана, а не отдельного файла"""
+        self.errors += 1
+        self.last_error = error
+    
+    def finish(self):
+        self.current["scan_seconds"] = time.perf_counter() - self.started
+        for field, value in self.current.items():
+            self.totals[field] += value
+        self.scans += 1
+        self.last = self.current
+        self.current = None
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Обратно из as_dict — например, для записи сложенных метрик нескольких сканеров"""
+        metrics = cls()
+        metrics.last = dict(data["last"])
+        metrics.totals = dict(data["totals"])
+        metrics.scans = data["scans"]
+        metrics.errors = data["errors"]
+        metrics.last_error = data["last_error"]
+        metrics.refresh = data.get("refresh")
+        return metrics
+    
+    def as_dict(self):
+        return {
+            "last": dict(self.last),
+            "totals": dict(self.totals),
+            "scans": self.scans,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "refresh": dict(self.refresh) if self.refresh else None,
+        }
+    
+    def to_prometheus(self, total_st):
+        """Текстовый формат Prometheus (для textfile-коллектора node exporter)"""
+        lines = []
+        for field in SCAN_METRIC_FIELDS:
+            name = f"token_widget_last_scan_{field}"
+            lines += [f"# HELP {name} {SCAN_METRIC_HELP[field]} (last scan)", f"# TYPE {name} gauge", f"{name} {self.last[field]}"]
+        for field in SCAN_METRIC_FIELDS:
+            name = f"token_widget_{field}_total"
+            lines += [f"# HELP {name} {SCAN_METRIC_HELP[field]}", f"# TYPE {name} counter", f"{name} {self.totals[field]}"]
+        lines += [
+            "# HELP token_widget_scans_total Session scans completed",
+            "# TYPE token_widget_scans_total counter",
+            f"token_widget_scans_total {self.scans}",
+            "# HELP token_widget_scan_errors_total Session scans aborted by an error",
+            "# TYPE token_widget_scan_errors_total counter",
+            f"token_widget_scan_errors_total {self.errors}",
+            "# HELP token_widget_total_st Standard Tokens across all sessions",
+            "# TYPE token_widget_total_st gauge",
+            f"token_widget_total_st {total_st}",
+        ]
+        if self.refresh:
+            lines += [
+                "# HELP token_widget_refresh_interval_seconds Current interval between session checks",
+                "# TYPE token_widget_refresh_interval_seconds gauge",
+                f"token_widget_refresh_interval_seconds {self.refresh['interval_seconds']}",
+                "# HELP token_widget_refresh_paused Whether session checks are paused (window hidden)",
+                "# TYPE token_widget_refresh_paused gauge",
+                f"token_widget_refresh_paused {int(self.refresh['state'] == REFRESH_PAUSED)}",
+            ]
+        return "\n".join(lines) + "\n"
+    
+    def write(self, path, total_st):
+        """Записать метрики в файл: .json — JSON, иначе формат Prometheus"""
+        if path.endswith(".json"):
+            data = self.as_dict()
+            data["total_st"] = total_st
+            text = json.dumps(data)
+        else:
+            text = self.to_prometheus(total_st)
+        try:
+            write_file_atomic(path, text)
+        except OSError as e:
+            print(f"Ошибка записи метрик: {e}")
+
+class SessionScanner:
+    """Фоновый поток сканирования сессий: UI получает готовые снимки через очередь"""
+    
+    # Меньше файлов на разбор не окупают запуск пула процессов
+    PARALLEL_MIN_FILES = 64
+    
+    def __init__(self, sessions_dir, index, workers=1, metrics_path=None, billing=None, on_snapshot=None, breakdowns=False, refresh=None):
+        self.sessions_dir = sessions_dir
+        self.index = index
+        # Вызывается из потока сканера после каждого нового снимка
+        self.on_snapshot = on_snapshot
+        # Класть ли в снимок разбивку по моделям и проектам (нужна агрегатору)
+        self.with_breakdowns = breakdowns
+        self.workers = max(1, workers)
+        self.metrics = ScanMetrics()
+        # Куда писать метрики после каждого скана (None — не писать)
+        self.metrics_path = metrics_path
+        self.cache = SessionCache()
+        self.usage = UsageStore()
+        self.billing = billing or BillingWindow()
+        # Интервал опроса без inotify и пауза, пока окно скрыто
+        self.refresh = refresh or RefreshScheduler()
+        self.walker = SessionTreeWalker(sessions_dir, self.cache)
+        # Новые файлы старше расчётного периода: на расход периода они не влияют,
+        # поэтому полный скан откладывает их разбор до выхода снимка периода
+        self.deferred = []
+        self.snapshots = queue.Queue()
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.full_scan_requested = False
+        self.watcher = None
+        self.thread = None
+    
+    def start(self):
+        # Наблюдатель запускается до первого скана, чтобы не потерять изменения между ними
+        self.watcher = create_session_watcher(self.sessions_dir, notify=self.wakeup.set, scheduler=self.refresh)
+        self.refresh.event_driven = not isinstance(self.watcher, PollingWatcher)
+        self.watcher.start()
+        self.thread = threading.Thread(target=self.run, name="session-scanner", daemon=True)
+        self.thread.start()
+    
+    def request_full_scan(self):
+        """Запросить полный скан; повторные запросы до его начала склеиваются"""
+        with self.lock:
+            self.full_scan_requested = True
+        self.wakeup.set()
+    
+    def pause(self):
+        """Не сканировать, пока не вызван resume(): изменения копятся в наблюдателе"""
+        self.refresh.pause()
+    
+    def resume(self):
+        self.refresh.resume()
+        self.wakeup.set()
+    
+    def run(self):
+        try:
+            self.publish(self.calculate_all_sessions())
+            self.publish(self.calculate_deferred_sessions())
+            while not self.stop_event.is_set():
+                # Без изменений сессий просыпаемся к началу нового расчётного периода
+                self.wakeup.wait(self.billing.seconds_left())
+                self.wakeup.clear()
+                if self.stop_event.is_set():
+                    break
+                if self.refresh.paused:
+                    continue
+                
+                paths, full_rescan = self.watcher.drain()
+                with self.lock:
+                    full_rescan = full_rescan or self.full_scan_requested
+                    self.full_scan_requested = False
+                
+                if not self.watcher.is_alive():
+                    # inotify потерял каталог сессий — переходим на опрос
+                    self.watcher.stop()
+                    self.watcher = PollingWatcher(self.sessions_dir, notify=self.wakeup.set, scheduler=self.refresh)
+                    self.refresh.event_driven = False
+                    self.watcher.start()
+                    full_rescan = True
+                
+                if self.watcher.poll_due() and not full_rescan:
+                    # Опрос: дерево обходится здесь же и сравнивается с кэшем
+                    polled = self.walker.changes(self.stop_event)
+                    if polled:
+                        self.refresh.activity()
+                        paths = paths | polled
+                    else:
+                        # Изменений нет или каталог недоступен — следующий обход позже
+                        self.refresh.idle()
+                elif paths and self.refresh.event_driven:
+                    self.refresh.activity()
+                if full_rescan:
+                    self.publish(self.calculate_all_sessions())
+                    self.publish(self.calculate_deferred_sessions())
+                elif paths:
+                    self.publish(self.calculate_changed_sessions(paths))
+                elif self.refresh_window():
+                    # Начался новый период — процент сбрасывается без скана
+                    self.publish((self.cache.total, self.cache.latest()))
+        except Exception as e:
+            print(f"Ошибка фонового сканирования: {e}")
+        finally:
+            self.watcher.stop()
+            self.index.close()
+    
+    def publish(self, result):
+        if result is not None and not self.stop_event.is_set():
+            self.snapshots.put(self.make_snapshot(result))
+            if self.on_snapshot is not None:
+                self.on_snapshot()
+    
+    def make_snapshot(self, result):
+        total, usage = result
+        breakdowns = self.breakdowns() if self.with_breakdowns else None
+        self.metrics.refresh = self.refresh.as_dict()
+        return SessionSnapshot(total, usage, self.metrics.as_dict(), self.window_info(), self.cache.latest_mtime(), None, breakdowns)
+    
+    def breakdowns(self):
+        """Расход по моделям и проектам за расчётный период (без периода — за всё время)
+        
+        Копия сумм, которые UsageStore ведёт по ходу скана: {"model": {имя: {USAGE_VALUES}}, "project": ...}.
+        """
+        return {
+            by: {name: dict(zip(USAGE_VALUES, sums)) for name, sums in self.usage.breakdown(by).items()}
+            for by in BREAKDOWN_KEYS
+        }
+    
+    def scan_snapshot(self):
+        """Разовый полный скан в текущем потоке вместе с отложенными файлами; None, если скан прерван"""
+        result = self.calculate_all_sessions()
+        if result is None:
+            return None
+        return self.make_snapshot(self.calculate_deferred_sessions() or result)
+    
+    def aggregate(self):
+        """Итоги по всем сессиям из колонок кэша (SessionColumns.aggregate)"""
+        return self.cache.columns.aggregate()
+    
+    def refresh_window(self):
+        """Пересчитать границы расчётного периода; True, если период сменился"""
+        bounds = self.billing.bounds()
+        if bounds is None:
+            return False
+        start, end = bounds
+        return self.usage.set_window(start.toordinal(), end.toordinal())
+    
+    def window_start_ns(self):
+        """Начало расчётного периода в наносекундах Unix (None — периода нет)"""
+        if self.usage.window is None:
+            return None
+        start = date.fromordinal(self.usage.window[0])
+        return int(datetime(start.year, start.month, start.day).timestamp()) * 1_000_000_000
+    
+    def window_info(self):
+        if self.usage.window is None:
+            return None
+        start, end = self.usage.window
+        return {
+            "policy": self.billing.policy,
+            "start": date.fromordinal(start).isoformat(),
+            "end": date.fromordinal(end).isoformat(),
+            "total_st": self.usage.window_total,
+        }
+    
+    def latest_snapshot(self):
+        """Последний готовый снимок (промежуточные пропускаются) или None"""
+        snapshot = None
+        try:
+            while True:
+                snapshot = self.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        return snapshot
+    
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread is None:
+            # Поток не успел стартовать — ресурсы закрываем сами
+            self.index.close()
+        elif self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+    
+    def load_session_index(self):
+        """Загрузить записи постоянного индекса в кэш сессий"""
+        rows = self.index.rows()
+        self.cache.load(rows)
+        
+        self.usage.load(*self.index.usage())
+        if self.usage.is_empty():
+            # Индекс от прежней версии без сводок: весь расход сессии относим к её mtime
+            # (model пустая у файлов без tokenUsage — у них нет расхода)
+            for path, mtime_ns, size, model, *counts, session_st in rows:
+                if model is not None:
+                    self.usage.record(mtime_ns / 1e9, model, os.path.basename(os.path.dirname(path)), (session_st, *counts))
+    
+    def store_session(self, file_path, mtime_ns, size, usage, error):
+        """Положить результат разбора в кэш и отнести прирост расхода к mtime файла"""
+        old = self.cache.session(file_path)
+        if error is not None and old is not None and old.model is not None:
+            # Недописанный или битый файл не обнуляет уже посчитанную сессию:
+            # иначе после исправления её расход попал бы в сводки второй раз
+            usage = old
+        self.cache.put(file_path, mtime_ns, size, usage)
+        
+        old_values = old.usage_values() if old is not None else (0,) * len(USAGE_VALUES)
+        deltas = [new - prev for new, prev in zip(usage.usage_values(), old_values)]
+        if any(deltas):
+            model_name = usage.model or (old.model if old is not None else None) or "unknown"
+            self.usage.record(mtime_ns / 1e9, model_name, os.path.basename(os.path.dirname(file_path)), deltas)
+    
+    def remove_sessions(self, removed):
+        """Вычесть из сводок расход удалённых из кэша сессий: {path: (mtime_ns, SessionUsage)}
+        
+        Сводки остаются суммой по сессиям индекса: вернувшийся или переименованный
+        файл снова добавит свой расход целиком, не посчитавшись дважды.
+        """
+        for file_path, (mtime_ns, usage) in removed.items():
+            values = usage.usage_values()
+            if usage.model is not None and any(values):
+                self.usage.record(mtime_ns / 1e9, usage.model, os.path.basename(os.path.dirname(file_path)), [-value for value in values])
+    
+    def update_session_file(self, file_path, stat):
+        """Перечитать файл сессии, только если он изменился с прошлого скана"""
+        if self.cache.get(file_path, stat.st_mtime_ns, stat.st_size) is None:
+            usage, bytes_read, error = scan_session_file(file_path)
+            self.metrics.record_parse(bytes_read, error)
+            self.store_session(file_path, stat.st_mtime_ns, stat.st_size, usage, error)
+        else:
+            self.metrics.add("cache_hits")
+    
+    def parse_shards(self, shards):
+        """Разобрать изменённые файлы, по шарду на проект; порядок результатов = порядок шардов"""
+        paths = [[path for path, _ in shard] for shard in shards]
+        if self.workers > 1 and sum(len(shard) for shard in shards) >= self.PARALLEL_MIN_FILES:
+            try:
+                with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                    return list(pool.map(parse_session_files, paths))
+            except Exception as e:
+                print(f"Параллельный разбор недоступен, разбираем последовательно: {e}")
+        return [parse_session_files(shard) for shard in paths]
+    
+    def parse_files(self, files):
+        """Разобрать файлы [(путь, mtime_ns, размер)] по шардам проектов и сложить в кэш"""
+        shards = {}
+        for file_path, mtime_ns, size in files:
+            shards.setdefault(os.path.dirname(file_path), []).append((file_path, (mtime_ns, size)))
+        shards = [sorted(shards[project_path]) for project_path in sorted(shards)]
+        
+        # Слияние в порядке проектов и файлов: при равном mtime «последняя» сессия
+        # не зависит от того, какой воркер закончил раньше
+        for shard, results in zip(shards, self.parse_shards(shards)):
+            for (file_path, (mtime_ns, size)), (usage, bytes_read, error) in zip(shard, results):
+                self.metrics.record_parse(bytes_read, error)
+                self.store_session(file_path, mtime_ns, size, usage, error)
+    
+    def calculate_all_sessions(self):
+        """Просканировать все сессии Factory и посчитать общую сумму ST"""
+        # Перечитываем только файлы с изменившимися mtime/размером,
+        # общая сумма обновляется на разницу по изменённым и удалённым файлам
+        if not self.cache.loaded:
+            self.load_session_index()
+        self.refresh_window()
+        
+        self.metrics.begin()
+        try:
+            # Полный скан бывает редко (старт, ручное обновление, сбой наблюдателя),
+            # поэтому без отсечения каталогов — stat каждого файла из DirEntry
+            files = self.walker.walk(self.stop_event)
+            if files is None:
+                # Прерванный скан или недоступный каталог не должен удалять из кэша
+                # непросмотренные файлы — остаётся прежний снимок
+                if not self.stop_event.is_set():
+                    print(f"Каталог сессий недоступен: {self.sessions_dir}")
+                return None
+            self.metrics.add("files_stated", len(files))
+            
+            # Изменённые файлы старше расчётного периода на его расход не влияют —
+            # их разбирает calculate_deferred_sessions после снимка. Итоги за всё
+            # время копятся в индексе, так что каждый старый файл разбирается один раз
+            window_start_ns = self.window_start_ns()
+            self.deferred = []
+            changed = []
+            for file_path, mtime_ns, size in files:
+                if self.cache.get(file_path, mtime_ns, size) is not None:
+                    self.metrics.add("cache_hits")
+                elif window_start_ns is not None and mtime_ns < window_start_ns:
+                    self.deferred.append((file_path, mtime_ns, size))
+                else:
+                    changed.append((file_path, mtime_ns, size))
+            self.metrics.add("files_deferred", len(self.deferred))
+            self.parse_files(changed)
+            
+            # Удаляем вклад файлов, которые пропали с диска
+            self.remove_sessions(self.cache.prune({file_path for file_path, _, _ in files}))
+        except Exception as e:
+            # Итог остаётся прежним, но сбой виден в консоли и в метриках
+            print(f"Ошибка скана сессий: {e}")
+            self.metrics.record_error(f"{type(e).__name__}: {e}")
+        
+        self.index.apply(*self.cache.drain_changes(), usage=self.usage.drain_changes())
+        self.finish_scan()
+        
+        return self.cache.total, self.cache.latest()
+    
+    def calculate_deferred_sessions(self):
+        """Разобрать файлы, отложенные полным сканом; None, если откладывать было нечего"""
+        if not self.deferred:
+            return None
+        files, self.deferred = self.deferred, []
+        
+        self.metrics.begin()
+        try:
+            # Файл могли уже разобрать по событию наблюдателя
+            self.parse_files([file for file in files if self.cache.get(*file) is None])
+        except Exception as e:
+            print(f"Ошибка скана сессий: {e}")
+            self.metrics.record_error(f"{type(e).__name__}: {e}")
+        
+        self.index.apply(*self.cache.drain_changes(), usage=self.usage.drain_changes())
+        self.finish_scan()
+        
+        return self.cache.total, self.cache.latest()
+    
+    def finish_scan(self):
+        self.metrics.finish()
+        if self.metrics_path:
+            self.metrics.write(self.metrics_path, self.cache.total)
+    
+    def calculate_changed_sessions(self, paths):
+        """Пересчитать только изменившиеся файлы сессий"""
+        if not self.cache.loaded:
+            return self.calculate_all_sessions()
+        self.refresh_window()
+        
+        self.metrics.begin()
+        for file_path in paths:
+            if not file_path.endswith(".settings.json"):
+                continue
+            self.metrics.add("files_stated")
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                # Файл удалён или переименован
+                removed = self.cache.remove(file_path)
+                if removed is not None:
+                    self.remove_sessions({file_path: removed})
+                continue
+            try:
+                self.update_session_file(file_path, stat)
+            except Exception as e:
+                # Один необычный файл не должен останавливать поток сканера
+                print(f"Ошибка обработки {file_path}: {e}")
+                self.metrics.record_error(f"{type(e).__name__}: {e}")
+        
+        self.index.apply(*self.cache.drain_changes(), usage=self.usage.drain_changes())
+        self.finish_scan()
+        
+        return self.cache.total, self.cache.latest()
+
+def merge_scan_metrics(metrics):
+    """Сложить ScanMetrics.as_dict нескольких сканеров; None, если сканов ещё не было
+    
+    Корни сканируются параллельно, поэтому время последнего скана — наибольшее, а не сумма.
+    """
+    if not metrics:
+        return None
+    last = dict.fromkeys(SCAN_METRIC_FIELDS, 0)
+    totals = dict.fromkeys(SCAN_METRIC_FIELDS, 0)
+    for data in metrics:
+        for field in SCAN_METRIC_FIELDS:
+            if field == "scan_seconds":
+                last[field] = max(last[field], data["last"][field])
+            else:
+                last[field] += data["last"][field]
+            totals[field] += data["totals"][field]
+    return {
+        "last": last,
+        "totals": totals,
+        "scans": sum(data["scans"] for data in metrics),
+        "errors": sum(data["errors"] for data in metrics),
+        "last_error": next((data["last_error"] for data in metrics if data["last_error"]), None),
+        "refresh": merge_refresh_states([data["refresh"] for data in metrics if data.get("refresh")]),
+    }
+
+def merge_breakdowns(breakdowns):
+    """Сложить SessionScanner.breakdowns нескольких корней; None, если их нет"""
+    if not breakdowns:
+        return None
+    merged = {by: {} for by in BREAKDOWN_KEYS}
+    for breakdown in breakdowns:
+        for by, groups in breakdown.items():
+            for name, values in groups.items():
+                sums = merged[by].get(name)
+                if sums is None:
+                    merged[by][name] = dict(values)
+                else:
+                    for key, value in values.items():
+                        sums[key] += value
+    return merged
+
+def merge_aggregates(aggregates):
+    """Сложить итоги SessionColumns.aggregate нескольких кэшей"""
+    by_model = {}
+    for aggregate in aggregates:
+        for model, totals in aggregate["by_model"].items():
+            merged = by_model.get(model)
+            if merged is None:
+                by_model[model] = dict(totals)
+            else:
+                for key, value in totals.items():
+                    merged[key] += value
+    return aggregate_summary(by_model)
+
+def root_index_path(index_path, root, roots):
+    """Файл индекса корня сессий: у единственного корня — сам index_path, иначе свой на каждый
+    
+    Сводки расхода в индексе не привязаны к каталогу, поэтому общий файл на
+    несколько корней перемешал бы их.
+    """
+    if len(roots) == 1 or index_path == ":memory:":
+        return index_path
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:12]
+    base, ext = os.path.splitext(index_path)
+    return f"{base}.{digest}{ext}"
+
+class MergedUsage:
+    """Сводки расхода нескольких корней как один UsageStore (только totals)"""
+    
+    def __init__(self, stores):
+        self.stores = stores
+    
+    def totals(self, level, start=None, end=None, by=None):
+        merged = {}
+        for store in self.stores:
+            for key, sums in store.totals(level, start=start, end=end, by=by).items():
+                old = merged.get(key)
+                merged[key] = sums if old is None else [a + b for a, b in zip(old, sums)]
+        return merged
+
+class MultiRootScanner:
+    """Несколько каталогов сессий: у каждого свой SessionScanner — поток, кэш и индекс
+    
+    Снимки корней сводит отдельный поток: медленный или недоступный корень
+    не задерживает остальные, а пока он не досканирован, в сумму идёт его
+    итог из постоянного индекса.
+    """
+    
+    # Сколько разовый скан ждёт корень, прежде чем взять его итог из индекса
+    SCAN_TIMEOUT_SECONDS = 60
+    
+    def __init__(self, roots, index_path, workers=1, metrics_path=None, billing=None, breakdowns=False, snapshot_path=None, refresh=None):
+        # Один каталог, записанный по-разному, сканируется один раз
+        unique = {}
+        for root in roots:
+            root = os.path.expanduser(root)
+            unique.setdefault(os.path.abspath(root), root)
+        self.roots = list(unique.values())
+        self.billing = billing or BillingWindow()
+        self.metrics_path = metrics_path
+        # Бинарный снимок итогов для частых читателей (snapshot_file.py)
+        self.snapshot_file = SnapshotFileWriter(snapshot_path) if snapshot_path else None
+        self.snapshots = queue.Queue()
+        self.updated = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        
+        self.scanners = []
+        self.baselines = []
+        for root in self.roots:
+            index = SessionIndex(root_index_path(index_path, root, self.roots))
+            index.open()
+            self.baselines.append(self.index_baseline(index))
+            # У каждого корня свой откат интервала, политика (refresh — словарь конфига) общая
+            self.scanners.append(SessionScanner(
+                root, index, workers=workers, billing=self.billing,
+                on_snapshot=self.updated.set, breakdowns=breakdowns,
+                refresh=RefreshScheduler.from_config(refresh),
+            ))
+        # Последний снимок каждого корня (None — ещё не досканирован)
+        self.root_snapshots = [None] * len(self.scanners)
+        # Потоки разового скана (scan_snapshot) по корням
+        self.scan_threads = [None] * len(self.scanners)
+        self.usage = MergedUsage([scanner.usage for scanner in self.scanners])
+    
+    def index_baseline(self, index):
+        """Снимок корня по его постоянному индексу — до первого скана; None, если индекс пуст"""
+        summary = index.summary()
+        if summary is None:
+            return None
+        total, (latest_ns, *latest) = summary
+        window = None
+        bounds = self.billing.bounds()
+        if bounds is not None:
+            start, end = bounds
+            window = {
+                "policy": self.billing.policy,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "total_st": index.window_total(start.toordinal(), end.toordinal()),
+            }
+        return SessionSnapshot(total, SessionUsage(*latest), None, window, latest_ns)
+    
+    def start(self):
+        # До первого скана читатели видят итоги из индексов
+        write_snapshot_file(self.snapshot_file, self.merge())
+        for scanner in self.scanners:
+            scanner.start()
+        self.thread = threading.Thread(target=self.run, name="session-roots", daemon=True)
+        self.thread.start()
+    
+    def request_full_scan(self):
+        for scanner in self.scanners:
+            scanner.request_full_scan()
+    
+    def pause(self):
+        for scanner in self.scanners:
+            scanner.pause()
+    
+    def resume(self):
+        for scanner in self.scanners:
+            scanner.resume()
+    
+    def refresh_state(self):
+        """Сводное состояние RefreshScheduler корней — сейчас, а не на момент последнего снимка"""
+        return merge_refresh_states([scanner.refresh.as_dict() for scanner in self.scanners])
+    
+    def run(self):
+        while not self.stop_event.is_set():
+            self.updated.wait()
+            self.updated.clear()
+            if self.stop_event.is_set():
+                break
+            fresh = False
+            for i, scanner in enumerate(self.scanners):
+                snapshot = scanner.latest_snapshot()
+                if snapshot is not None:
+                    self.root_snapshots[i] = snapshot
+                    fresh = True
+            if fresh:
+                snapshot = self.merge()
+                self.write_metrics(snapshot)
+                write_snapshot_file(self.snapshot_file, snapshot)
+                self.snapshots.put(snapshot)
+    
+    def scan_snapshot(self, timeout=None):
+        """Разовый полный скан всех корней, каждого в своём потоке; сводный снимок
+        
+        Корень, не ответивший за timeout секунд (зависшее сетевое монтирование),
+        входит в сумму прошлым снимком или итогом из индекса. Его скан доделывается
+        в фоне и при следующем вызове не запускается второй раз.
+        """
+        if timeout is None:
+            timeout = self.SCAN_TIMEOUT_SECONDS
+        
+        def scan(i, scanner):
+            try:
+                snapshot = scanner.scan_snapshot()
+            except Exception as e:
+                print(f"Ошибка скана {scanner.sessions_dir}: {e}")
+                return
+            if snapshot is not None:
+                self.root_snapshots[i] = snapshot
+        
+        for i, scanner in enumerate(self.scanners):
+            thread = self.scan_threads[i]
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=scan, args=(i, scanner), name="session-root-scan", daemon=True)
+                self.scan_threads[i] = thread
+                thread.start()
+        deadline = time.monotonic() + timeout
+        for scanner, thread in zip(self.scanners, self.scan_threads):
+            thread.join(max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                print(f"Каталог {scanner.sessions_dir} не ответил за {timeout:g} с — в сумме его прежний итог")
+        return self.finish_snapshot()
+    
+    def scan_snapshot_inline(self):
+        """Разовый полный скан корней по очереди в текущем потоке — так его видит cProfile (app.py --profile)"""
+        for i, scanner in enumerate(self.scanners):
+            snapshot = scanner.scan_snapshot()
+            if snapshot is not None:
+                self.root_snapshots[i] = snapshot
+        return self.finish_snapshot()
+    
+    def finish_snapshot(self):
+        """Свести снимки корней, записать метрики и бинарный снимок"""
+        snapshot = self.merge()
+        self.write_metrics(snapshot)
+        write_snapshot_file(self.snapshot_file, snapshot)
+        return snapshot
+    
+    def merge(self):
+        """Сводный снимок: сумма по корням, самая свежая сессия и разбивка roots"""
+        total = 0
+        window_total = 0
+        usage = EMPTY_USAGE
+        latest_ns = None
+        metrics = []
+        breakdowns = []
+        roots = {}
+        for root, snapshot, baseline in zip(self.roots, self.root_snapshots, self.baselines):
+            ready = snapshot is not None
+            if not ready:
+                snapshot = baseline
+            if snapshot is None:
+                roots[root] = {"total_st": 0, "all_time_st": 0, "ready": False}
+                continue
+            root_st = snapshot.window["total_st"] if snapshot.window else snapshot.total
+            roots[root] = {"total_st": root_st, "all_time_st": snapshot.total, "ready": ready}
+            total += snapshot.total
+            window_total += root_st
+            if snapshot.metrics:
+                metrics.append(snapshot.metrics)
+            if snapshot.breakdowns:
+                breakdowns.append(snapshot.breakdowns)
+            if snapshot.latest_ns is not None and (latest_ns is None or snapshot.latest_ns > latest_ns):
+                latest_ns = snapshot.latest_ns
+                usage = snapshot.usage
+        
+        window = None
+        bounds = self.billing.bounds()
+        if bounds is not None:
+            start, end = bounds
+            window = {"policy": self.billing.policy, "start": start.isoformat(), "end": end.isoformat(), "total_st": window_total}
+        return SessionSnapshot(total, usage, merge_scan_metrics(metrics), window, latest_ns, roots, merge_breakdowns(breakdowns))
+    
+    def write_metrics(self, snapshot):
+        if self.metrics_path and snapshot.metrics:
+            ScanMetrics.from_dict(snapshot.metrics).write(self.metrics_path, snapshot.total)
+    
+    def aggregate(self):
+        """Итоги по моделям и доля кэша по всем корням"""
+        return merge_aggregates([scanner.aggregate() for scanner in self.scanners])
+    
+    def latest_snapshot(self):
+        """Последний готовый сводный снимок (промежуточные пропускаются) или None"""
+        snapshot = None
+        try:
+            while True:
+                snapshot = self.snapshots.get_nowait()
+        except queue.Empty:
+            pass
+        return snapshot
+    
+    def stop(self):
+        self.stop_event.set()
+        self.updated.set()
+        # Каждый сканер сам закрывает свой индекс
+        for scanner in self.scanners:
+            scanner.stop()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        if self.snapshot_file is not None:
+            self.snapshot_file.close()
+
+def write_snapshot_file(writer, snapshot):
+    """Записать итог, процент лимита и последнюю сессию снимка в бинарный файл (если он задан)"""
+    if writer is None:
+        return
+    total_st = snapshot.window["total_st"] if snapshot.window else snapshot.total
+    try:
+        writer.write(total_st, snapshot.total, MONTHLY_LIMIT, snapshot.usage.model, snapshot.usage.counts())
+    except (OSError, ValueError) as e:
+        print(f"Ошибка записи снимка {writer.path}: {e}")
+
+def write_file_atomic(path, text):
+    """Записать файл через временный и os.replace — при сбое остаётся старая версия"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class ConfigStore:
+    """Конфиг виджета: изменения копятся в памяти и пишутся фоновым потоком после паузы"""
+    
+    # Запись происходит, когда изменений не было столько секунд
+    QUIET_SECONDS = 0.5
+    
+    def __init__(self, path):
+        self.path = path
+        self.values = {}
+        self.cond = threading.Condition()
+        self.dirty = False
+        self.deadline = 0
+        self.closed = False
+        self.thread = None
+    
+    def load(self):
+        """Прочитать конфиг с диска; битый или отсутствующий файл даёт пустой словарь"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.values = data
+        except (OSError, ValueError):
+            pass
+        return dict(self.values)
+    
+    def update(self, values):
+        """Запомнить новые значения; на диск они попадут после паузы в изменениях"""
+        with self.cond:
+            changed = {key: value for key, value in values.items() if self.values.get(key, object()) != value}
+            if not changed or self.closed:
+                return
+            self.values.update(changed)
+            self.dirty = True
+            self.deadline = time.monotonic() + self.QUIET_SECONDS
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="config-writer", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+    
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed and (not self.dirty or time.monotonic() < self.deadline):
+                    self.cond.wait(None if not self.dirty else max(0, self.deadline - time.monotonic()))
+                if self.closed:
+                    return
+                text = self.take_dirty()
+            self.write(text)
+    
+    def take_dirty(self):
+        self.dirty = False
+        return json.dumps(self.values)
+    
+    def write(self, text):
+        try:
+            write_file_atomic(self.path, text)
+        except OSError as e:
+            print(f"Ошибка сохранения конфига: {e}")
+    
+    def close(self):
+        """Остановить фоновую запись и сохранить несохранённое (при выходе)"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+            text = self.take_dirty() if self.dirty else None
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        if text is not None:
+            self.write(text)
+
+class HistoryStore:
+    """История использования по дням: дописываемый журнал + периодическое сжатие в JSON"""
+    
+    # Журнал больше этого размера сворачивается в снимок истории
+    COMPACT_BYTES = 64 * 1024
+    # Хвост журнала, в котором ищется последняя запись
+    TAIL_BYTES = 4096
+    
+    def __init__(self, path):
+        # Снимок в прежнем формате {date: {"tokens": n}}, журнал — JSON-строки рядом
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + ".log"
+        self.total = None
+        self.last_date = None
+        self.last_tokens = None
+        self.log_size = 0
+        self.needs_newline = False
+    
+    def load_total(self):
+        """Сумма токенов по всем датам — из последней записи журнала, без обхода истории"""
+        if self.total is None:
+            self.load_tail()
+        return self.total
+    
+    def load_tail(self):
+        record = self.read_last_record()
+        if record is None:
+            # Журнала ещё нет (первый запуск или старая версия) — один раз считаем снимок целиком
+            days = self.load_days()
+            self.total = sum(days.values())
+            self.last_date = None
+            self.last_tokens = None
+            if days:
+                self.last_date = max(days)
+                self.last_tokens = days[self.last_date]
+                self.append_record()
+        else:
+            self.total = record["total"]
+            self.last_date = record["date"]
+            self.last_tokens = record["tokens"]
+    
+    def read_last_record(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                self.log_size = f.tell()
+                f.seek(max(0, self.log_size - self.TAIL_BYTES))
+                tail = f.read()
+        except OSError:
+            return None
+        
+        # Недописанная последняя строка (процесс убит на записи) пропускается,
+        # а следующая запись начнётся с новой строки, чтобы не склеиться с ней
+        self.needs_newline = bool(tail) and not tail.endswith(b"\n")
+        for line in reversed(tail.splitlines()):
+            try:
+                record = json.loads(line)
+                if {"date", "tokens", "total"} <= record.keys():
+                    return record
+            except (ValueError, AttributeError):
+                continue
+        return None
+    
+    def load_days(self):
+        """Полная история {date: tokens}: снимок + журнал поверх него"""
+        days = {}
+        try:
+            with open(self.path, "r") as f:
+                for date, data in json.load(f).items():
+                    days[date] = data.get("tokens", 0)
+        except (OSError, ValueError, AttributeError):
+            pass
+        
+        try:
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        days[record["date"]] = record["tokens"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+        return days
+    
+    def record(self, date, tokens):
+        """Записать значение за день; без изменений на диск ничего не пишется"""
+        if self.total is None:
+            self.load_tail()
+        if date == self.last_date:
+            if tokens == self.last_tokens:
+                return
+            old = self.last_tokens
+        else:
+            # Смена дня — редкое событие, здесь можно прочитать историю целиком
+            old = self.load_days().get(date, 0)
+        
+        self.total += tokens - old
+        self.last_date = date
+        self.last_tokens = tokens
+        self.append_record()
+        
+        if self.log_size >= self.COMPACT_BYTES:
+            self.compact()
+    
+    def append_record(self):
+        line = json.dumps({"date": self.last_date, "tokens": self.last_tokens, "total": self.total}) + "\n"
+        if self.needs_newline:
+            line = "\n" + line
+            self.needs_newline = False
+        with open(self.log_path, "a") as f:
+            f.write(line)
+        self.log_size += len(line)
+    
+    def compact(self):
+        """Свернуть журнал в снимок истории и оставить в журнале одну контрольную запись"""
+        days = self.load_days()
+        try:
+            with open(self.path, "r") as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            history = {}
+        for date, tokens in days.items():
+            entry = history.get(date)
+            if not isinstance(entry, dict):
+                entry = history[date] = {}
+            entry["tokens"] = tokens
+        
+        # Снимок пишется первым: если упадём до замены журнала, повторное
+        # применение его записей поверх снимка даёт тот же результат
+        write_file_atomic(self.path, json.dumps(history))
+        checkpoint = json.dumps({"date": self.last_date, "tokens": self.last_tokens, "total": self.total})
+        write_file_atomic(self.log_path, checkpoint + "\n")
+        self.log_size = len(checkpoint) + 1
+
+def snapshot_to_dict(snapshot):
+    """Снимок сканера в виде словаря для JSON-вывода"""
+    # С расчётным периодом лимит сравнивается с расходом в нём, а не за всё время
+    total_st = snapshot.window["total_st"] if snapshot.window else snapshot.total
+    return {
+        "total_st": total_st,
+        "monthly_limit": MONTHLY_LIMIT,
+        "percent": round(total_st / MONTHLY_LIMIT * 100, 4),
+        "window": snapshot.window,
+        "model": snapshot.usage.model,
+        "multiplier": snapshot.usage.multiplier,
+        "latest_session": snapshot.usage.raw_data(),
+        "latest_ns": snapshot.latest_ns,
+        "all_time_st": snapshot.total,
+        "roots": snapshot.roots,
+        "breakdowns": snapshot.breakdowns,
+        "metrics": snapshot.metrics,
+    }
+
+def snapshot_from_dict(data):
+    """Обратно из snapshot_to_dict — например, снимок, полученный от агрегатора"""
+    latest = data["latest_session"]
+    usage = SessionUsage(data["model"], *(latest.get(field, 0) for field in SESSION_COUNT_FIELDS))
+    return SessionSnapshot(
+        data["all_time_st"], usage, data["metrics"], data["window"],
+        data["latest_ns"], data["roots"], data["breakdowns"],
+    )
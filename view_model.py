@@ -0,0 +1,163 @@
+import os
+from functools import lru_cache
+
+from token_core import MONTHLY_LIMIT, REFRESH_EVENTS, REFRESH_PAUSED, top_groups
+
+MODE_MINIATURE = "miniature"
+MODE_COMPACT = "compact"
+MODE_FULL = "full"
+
+# Ширина прогресс-бара в пикселях для каждого режима
+COMPACT_BAR_WIDTH = 150
+FULL_BAR_WIDTH = 356
+# Длинные пути каталогов сессий обрезаются слева
+ROOT_LABEL_CHARS = 40
+# Сколько самых дорогих проектов и моделей показывает полный режим
+TOP_GROUPS = 3
+TOP_NAME_CHARS = 16
+
+@lru_cache(maxsize=64)
+def model_short_name(model):
+    """Короткое имя модели для подписи (результат кэшируется — моделей немного)"""
+    if model:
+        parts = model.split("-")
+        model_short = parts[-2] if len(parts) >= 2 else parts[0] if len(parts) > 0 else "?"
+    else:
+        model_short = "?"
+    if model and "haiku" in model.lower():
+        model_short = "Haiku"
+    elif model and "sonnet" in model.lower():
+        model_short = "Sonnet"
+    elif model and "opus" in model.lower():
+        model_short = "Opus"
+    elif model and "gpt" in model.lower():
+        model_short = "GPT"
+    return model_short
+
+def progress_color(percent):
+    if percent > 80:
+        return "#da3633"
+    elif percent > 50:
+        return "#d29922"
+    return "#238636"
+
+def scan_metrics_text(metrics):
+    """Одна строка о последнем скане: время, stat, разобрано, из кэша, сбои, объём"""
+    if not metrics:
+        return "⏱ Скан ещё не выполнялся"
+    last = metrics["last"]
+    text = (f"⏱ {last['scan_seconds'] * 1000:.0f} мс · stat {last['files_stated']:,} · "
+            f"разбор {last['files_parsed']:,} · кэш {last['cache_hits']:,} · "
+            f"сбоев {last['parse_failures']} · {last['bytes_read'] / 1024:,.0f} КБ")
+    if metrics["errors"]:
+        text += f" · ошибок скана {metrics['errors']}"
+    return text
+
+def refresh_text(refresh):
+    """Как сейчас проверяются сессии (RefreshScheduler.as_dict); пусто, если сканер не свой"""
+    if not refresh:
+        return ""
+    if refresh["state"] == REFRESH_PAUSED:
+        return "🔄 Проверки на паузе — окно скрыто"
+    if refresh["state"] == REFRESH_EVENTS:
+        return "🔄 Проверки по событиям файловой системы"
+    interval = refresh["interval_seconds"]
+    return f"🔄 Проверка раз в {interval:.2f} с" if interval < 10 else f"🔄 Проверка раз в {interval:.0f} с"
+
+def roots_text(roots):
+    """По строке на каталог сессий; пусто, если каталог один"""
+    if not roots or len(roots) < 2:
+        return ""
+    home = os.path.expanduser("~")
+    lines = []
+    for root, info in roots.items():
+        if root == home or root.startswith(home + os.sep):
+            root = "~" + root[len(home):]
+        if len(root) > ROOT_LABEL_CHARS:
+            root = "…" + root[-(ROOT_LABEL_CHARS - 1):]
+        # Каталог ещё не досканирован — показан итог из его индекса
+        lines.append(f"📁 {root}: {info['total_st']:,}{'' if info['ready'] else ' …'}")
+    return "\n".join(lines)
+
+def short_st(st):
+    if st >= 1_000_000:
+        return f"{st / 1_000_000:.1f}M"
+    if st >= 1_000:
+        return f"{st / 1_000:.0f}K"
+    return f"{st}"
+
+def top_text(breakdowns):
+    """Самые дорогие проекты и модели: по строке на разбивку; пусто, пока разбивок нет"""
+    if not breakdowns:
+        return ""
+    lines = []
+    for by, title in (("project", "Проекты"), ("model", "Модели")):
+        groups = top_groups(breakdowns.get(by, {}), TOP_GROUPS)
+        if not groups:
+            continue
+        names = []
+        for name, values in groups:
+            name = model_short_name(name) if by == "model" else name
+            if len(name) > TOP_NAME_CHARS:
+                name = name[:TOP_NAME_CHARS - 1] + "…"
+            names.append(f"{name} {short_st(values['st'])}")
+        lines.append(f"🏆 {title}: " + " · ".join(names))
+    return "\n".join(lines)
+
+def build_view_state(mode, total_st, usage, metrics=None, window=None, roots=None, breakdowns=None, refresh=None):
+    """Что должно быть на экране: {имя виджета: {опция: значение}} без обращения к Tk
+    
+    usage — SessionUsage последней сессии: модель и разбивка её токенов,
+    roots — разбивка итога по каталогам сессий (SessionSnapshot.roots),
+    breakdowns — расход по моделям и проектам за период (SessionSnapshot.breakdowns),
+    refresh — текущий интервал проверок (RefreshScheduler.as_dict).
+    """
+    percent = (total_st / MONTHLY_LIMIT) * 100
+    model_short = model_short_name(usage.model)
+    
+    if mode == MODE_MINIATURE:
+        return {"percent_label": {"text": f"{percent:.1f}%"}}
+    
+    if mode == MODE_COMPACT:
+        return {
+            "total_label": {"text": f"{total_st:,}"},
+            "percent_label": {"text": f"{percent:.1f}%"},
+            "progress_bar": {
+                "width": min(int((total_st / MONTHLY_LIMIT) * COMPACT_BAR_WIDTH), COMPACT_BAR_WIDTH),
+                "bg": progress_color(percent),
+            },
+            "model_label": {"text": f"{model_short}"},
+        }
+    
+    cache_total = usage.cache_create + usage.cache_read
+    cache_st = usage.cache_create_st + usage.cache_read_st
+    cache_percent = ((cache_st / total_st) * 100) if total_st > 0 else 0
+    return {
+        "total_label": {"text": f"{total_st:,}"},
+        "period_label": {"text": f"Standard Tokens (с {window['start']})" if window else "Standard Tokens (за всё время)"},
+        "percent_label": {"text": f"{percent:.2f}% / 20M"},
+        "model_label": {"text": f"Модель: {model_short} (×{usage.multiplier})"},
+        "cache_label": {"text": f"⚡ Кэш: {cache_total:,} / {cache_st:,} ST"},
+        "output_label": {"text": f"📤 Выход: {usage.output:,} / {usage.output_st:,} ST"},
+        "input_label": {"text": f"⬆️ Вход: {usage.input:,} / {usage.input_st:,} ST"},
+        "metrics_label": {"text": scan_metrics_text(metrics)},
+        "refresh_label": {"text": refresh_text(refresh)},
+        "roots_label": {"text": roots_text(roots)},
+        "top_label": {"text": top_text(breakdowns)},
+        "progress_bar": {
+            "width": min(int((total_st / MONTHLY_LIMIT) * FULL_BAR_WIDTH), FULL_BAR_WIDTH),
+            "bg": progress_color(percent),
+        },
+        "cache_progress_bar": {"width": min(int((cache_st / MONTHLY_LIMIT) * FULL_BAR_WIDTH), FULL_BAR_WIDTH)},
+        "cache_percent_label": {"text": f"{cache_percent:.1f}% кэша ({cache_st:,} ST)"},
+    }
+
+def diff_view_state(rendered, state):
+    """Только изменившиеся опции: {имя виджета: {опция: новое значение}}"""
+    changes = {}
+    for name, options in state.items():
+        old = rendered.get(name, {})
+        changed = {key: value for key, value in options.items() if old.get(key) != value}
+        if changed:
+            changes[name] = changed
+    return changes
@@ -0,0 +1,952 @@
+import tkinter as tk
+from tkinter import font, messagebox
+import os
+from datetime import datetime
+import threading
+import time
+
+from token_core import (
+    MODEL_MULTIPLIERS,
+    MONTHLY_LIMIT,
+    DEFAULT_SESSIONS_DIR,
+    DEFAULT_INDEX_PATH,
+    DEFAULT_SCAN_WORKERS,
+    DEFAULT_HISTORY_PATH,
+    DEFAULT_METRICS_PATH,
+    BillingWindow,
+    ConfigStore,
+    HistoryStore,
+    MultiRootScanner,
+    RefreshScheduler,
+    EMPTY_USAGE,
+)
+from aggregator import DEFAULT_AGGREGATOR_TOKEN_PATH, DEFAULT_AGGREGATOR_URL, connect_session_source
+from snapshot_file import DEFAULT_SNAPSHOT_PATH
+from view_model import MODE_MINIATURE, MODE_COMPACT, MODE_FULL, build_view_state, diff_view_state
+
+# psutil необязателен: без него проверка лока просто менее точная.
+# Устанавливать пакеты на старте нельзя — pip может надолго заблокировать запуск
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Бенчмарк старта передаёт в этой переменной время запуска процесса (time.time())
+STARTUP_PROBE_ENV = "TOKEN_WIDGET_STARTUP_PROBE"
+
+class SingleInstanceChecker:
+    """Проверка на множественное открытие приложения с файловым локом"""
+    
+    def __init__(self):
+        self.lock_file_path = os.path.join(os.path.expanduser("~"), ".token_widget.lock")
+        self.lock_file = None
+        self.has_lock = False
+    
+    def is_instance_running(self):
+        """Проверить, запущен ли уже экземпляр приложения"""
+        try:
+            # Если файл не существует, процесс не работает
+            if not os.path.exists(self.lock_file_path):
+                return False
+            
+            # Если файл существует, пытаемся открыть его для чтения
+            try:
+                with open(self.lock_file_path, 'r') as f:
+                    pid_str = f.read().strip()
+                    if pid_str and pid_str.isdigit():
+                        pid = int(pid_str)
+                        
+                        # Если psutil доступен, используем его для точной проверки
+                        if psutil:
+                            if psutil.pid_exists(pid):
+                                return True
+                            else:
+                                # PID не существует, удаляем старый файл
+                                try:
+                                    os.remove(self.lock_file_path)
+                                except:
+                                    pass
+                                return False
+                        else:
+                            # psutil не доступен, предполагаем что процесс работает
+                            return True
+            except IOError:
+                # Файл заблокирован - его держит другой процесс
+                return True
+            
+            return False
+        except:
+            return False
+    
+    def acquire_lock(self):
+        """Попытка захватить лок"""
+        try:
+            # Если файл существует, пытаемся его удалить
+            if os.path.exists(self.lock_file_path):
+                try:
+                    os.remove(self.lock_file_path)
+                except OSError:
+                    # Если не удалось удалить - его держит другой процесс
+                    return False
+            
+            # Создаём новый файл с текущим PID
+            self.lock_file = open(self.lock_file_path, 'w')
+            self.lock_file.write(str(os.getpid()))
+            self.lock_file.flush()
+            self.has_lock = True
+            return True
+        except Exception as e:
+            print(f"Ошибка захвата лока: {e}")
+            return False
+    
+    def release(self):
+        """Освободить лок; чужой лок (профилировщик, второй экземпляр) не трогаем"""
+        if not self.has_lock:
+            return
+        try:
+            if self.lock_file:
+                self.lock_file.close()
+                self.lock_file = None
+            
+            # Пытаемся удалить файл несколько раз
+            for attempt in range(3):
+                try:
+                    if os.path.exists(self.lock_file_path):
+                        os.remove(self.lock_file_path)
+                    break
+                except Exception as e:
+                    if attempt < 2:
+                        import time
+                        time.sleep(0.1)
+                    else:
+                        pass
+            
+            self.has_lock = False
+        except:
+            pass
+
+class TokenWidget:
+    MODEL_MULTIPLIERS = MODEL_MULTIPLIERS
+    
+    MONTHLY_LIMIT = MONTHLY_LIMIT
+    DEFAULT_SCAN_WORKERS = DEFAULT_SCAN_WORKERS
+    # UI забирает готовые снимки у фонового сканера с тем же откатом интервала,
+    # что и опрос сессий, но не реже раза в секунду: с inotify скан идёт сразу
+    SNAPSHOT_POLL_MAX_SECONDS = 1.0
+    THEME_LIGHT = "light"
+    THEME_DARK = "dark"
+    
+    def __init__(self, root, session_roots=None, state_dir=None, interactive=True):
+        # interactive=False — окно для профилирования (app.py --profile): без лока
+        # единственного экземпляра, фонового сканера и трея; state_dir подменяет
+        # домашний каталог для конфига, истории, индекса и метрик; session_roots
+        # подменяет каталоги сессий из конфига
+        self.root = root
+        self.single_instance = SingleInstanceChecker()
+        
+        print("DEBUG: Начало инициализации")
+        
+        # Сначала проверяем, работает ли уже экземпляр
+        if interactive and self.single_instance.is_instance_running():
+            print("DEBUG: Обнаружен работающий экземпляр")
+            # Приложение уже запущено
+            self.root.withdraw()
+            self.root.after(100, self.root.quit)
+            return
+        
+        print("DEBUG: Экземпляр не найден, захватываем лок")
+        
+        # Пытаемся захватить лок
+        if interactive and not self.single_instance.acquire_lock():
+            print("DEBUG: Не удалось захватить лок")
+            # Не смогли захватить лок - приложение уже работает
+            self.root.withdraw()
+            self.root.after(100, self.root.quit)
+            return
+        
+        print("DEBUG: Лок захвачен успешно")
+        
+        self.root.protocol("WM_DESTROY", self.cleanup_on_exit)
+        
+        self.compact_mode = True
+        home = state_dir or os.path.expanduser("~")
+        self.config_file = os.path.join(home, ".token_widget.json")
+        self.config = ConfigStore(self.config_file)
+        self.history = HistoryStore(os.path.join(home, os.path.basename(DEFAULT_HISTORY_PATH)))
+        self.default_metrics_path = os.path.join(home, os.path.basename(DEFAULT_METRICS_PATH))
+        self.default_snapshot_path = os.path.join(home, os.path.basename(DEFAULT_SNAPSHOT_PATH))
+        self.load_data()
+        if session_roots:
+            self.session_roots = list(session_roots)
+        index_path = os.path.join(home, os.path.basename(DEFAULT_INDEX_PATH))
+        create_scanner = lambda: MultiRootScanner(
+            self.session_roots, index_path,
+            workers=self.scan_workers, metrics_path=self.metrics_file, billing=self.billing,
+            snapshot_path=self.snapshot_file, breakdowns=True, refresh=self.refresh_policy,
+        )
+        # Если запущен агрегатор (app.py --serve) — берём готовые снимки у него,
+        # иначе (или когда он пропадёт) сканируем в своём процессе
+        if interactive:
+            self.session_scanner = connect_session_source(
+                self.aggregator_url, self.session_roots, create_scanner, self.snapshot_file,
+                os.path.join(home, os.path.basename(DEFAULT_AGGREGATOR_TOKEN_PATH)),
+            )
+        else:
+            self.session_scanner = create_scanner()
+        self.load_index_totals()
+        
+        print(f"DEBUG: Размер окна {self.miniature_mode}, компактный режим: {self.compact_mode}")
+        
+        self.root.title("Токены")
+        
+        screen_w = self.root.winfo_screenwidth()
+        screen_h = self.root.winfo_screenheight()
+        
+        if self.miniature_mode:
+            w, h = 50, 50
+        else:
+            w, h = 170, 150
+        
+        new_x = self.current_x
+        new_y = self.current_y
+        
+        if new_x < 0 or new_x + w > screen_w:
+            new_x = 10
+        if new_y < 0 or new_y + h > screen_h:
+            new_y = 10
+        
+        self.current_x = new_x
+        self.current_y = new_y
+        
+        print(f"DEBUG: Геометрия окна: {w}x{h}+{new_x}+{new_y}")
+        self.root.geometry(f"{w}x{h}+{new_x}+{new_y}")
+        self.root.attributes("-alpha", self.alpha_value)
+        self.root.overrideredirect(True)
+        self.root.protocol("WM_DELETE_WINDOW", self.hide_window)
+        
+        self.drag_data = {"x": 0, "y": 0}
+        self.root.bind("<Button-1>", self.on_click)
+        self.root.bind("<B1-Motion>", self.on_drag)
+        self.root.bind("<Button-3>", self.show_menu)
+        
+        self.icon = None
+        self.tray_thread = None
+        
+        print("DEBUG: Показываем окно")
+        # Показываем окно по умолчанию
+        self.root.deiconify()
+        self.root.lift()
+        print("DEBUG: Окно должно быть видно")
+        
+        self.bg_color = "#0d1117"
+        self.fg_color = "#58a6ff"
+        self.root.configure(bg=self.bg_color)
+        
+        self.main_frame = tk.Frame(self.root, bg=self.bg_color)
+        self.main_frame.pack(fill=tk.BOTH, expand=True, padx=8, pady=8)
+        
+        self.fonts = {}
+        self.layouts = {}
+        self.active_layout = None
+        
+        self.create_ui()
+        self.update_display()
+        if interactive:
+            self.report_startup_probe()
+            # Сканер и трей запускаем после отрисовки окна, чтобы сразу показать данные из индекса
+            self.root.after_idle(lambda: self.root.after(0, self.after_first_paint))
+    
+    def create_ui(self):
+        """Показать раскладку текущего режима; каждая строится один раз и дальше переиспользуется"""
+        mode = self.display_mode()
+        layout = self.layouts.get(mode)
+        if layout is None:
+            builders = {
+                MODE_MINIATURE: self.create_miniature_ui,
+                MODE_COMPACT: self.create_compact_ui,
+                MODE_FULL: self.create_full_ui,
+            }
+            frame = tk.Frame(self.main_frame, bg=self.bg_color)
+            layout = self.layouts[mode] = {"frame": frame, "widgets": builders[mode](frame), "rendered": {}}
+        
+        # Переключение режима — только смена упакованного фрейма
+        if self.active_layout is not layout:
+            if self.active_layout is not None:
+                self.active_layout["frame"].pack_forget()
+            layout["frame"].pack(fill=tk.BOTH, expand=True)
+            self.active_layout = layout
+        
+        self.widgets = layout["widgets"]
+        # У каждой раскладки своё отрисованное состояние — diff считается относительно него
+        self.rendered_state = layout["rendered"]
+    
+    def get_font(self, size, weight="normal"):
+        """Общий кэш шрифтов: одинаковые шрифты не создаются повторно"""
+        key = (size, weight)
+        if key not in self.fonts:
+            self.fonts[key] = font.Font(family="Segoe UI", size=size, weight=weight)
+        return self.fonts[key]
+    
+    def create_miniature_ui(self, parent):
+        info_font = self.get_font(12, "bold")
+        
+        percent_label = tk.Label(parent, text="0%", bg=self.bg_color, fg="#79c0ff", font=info_font, relief=tk.FLAT, bd=0)
+        percent_label.pack()
+        
+        return {
+            "percent_label": percent_label,
+        }
+    
+    def create_compact_ui(self, parent):
+        parent.configure(relief=tk.FLAT, bd=0)
+        
+        info_font = self.get_font(15, "bold")
+        small_font = self.get_font(10)
+        tiny_font = self.get_font(8)
+        
+        total_label = tk.Label(parent, text="0", bg=self.bg_color, fg=self.fg_color, font=info_font, relief=tk.FLAT, bd=0)
+        total_label.pack()
+        
+        model_label = tk.Label(parent, text="Haiku", bg=self.bg_color, fg="#79c0ff", font=small_font, relief=tk.FLAT, bd=0)
+        model_label.pack()
+        
+        # Прогресс бар
+        progress_frame = tk.Frame(parent, bg="#30363d", height=6)
+        progress_frame.pack(fill=tk.X, pady=4)
+        
+        progress_bar = tk.Frame(progress_frame, bg="#238636", height=6)
+        progress_bar.pack(side=tk.LEFT, fill=tk.Y)
+        
+        percent_label = tk.Label(parent, text="0%", bg=self.bg_color, fg="#79c0ff", font=tiny_font, relief=tk.FLAT, bd=0)
+        percent_label.pack()
+        
+        return {
+            "total_label": total_label,
+            "model_label": model_label,
+            "progress_bar": progress_bar,
+            "percent_label": percent_label,
+        }
+    
+    def create_full_ui(self, parent):
+        total_font = self.get_font(28, "bold")
+        total_label = tk.Label(parent, text="0", bg=self.bg_color, fg=self.fg_color, font=total_font)
+        total_label.pack(pady=(0, 2))
+        
+        sub_font = self.get_font(9)
+        period_label = tk.Label(parent, text="Standard Tokens (эта сессия)", bg=self.bg_color, fg="#8b949e", font=sub_font)
+        period_label.pack()
+        
+        model_label = tk.Label(parent, text="Модель: Не определена", bg=self.bg_color, fg="#79c0ff", font=sub_font)
+        model_label.pack(pady=(6, 0))
+        
+        sep = tk.Frame(parent, bg="#30363d", height=1)
+        sep.pack(fill=tk.X, pady=8)
+        
+        info_font = self.get_font(8)
+        cache_label = tk.Label(parent, text="⚡ Кэш: 0 / 0 ST", bg=self.bg_color, fg="#79c0ff", font=info_font)
+        cache_label.pack(anchor=tk.W)
+        
+        output_label = tk.Label(parent, text="📤 Выход: 0 / 0 ST", bg=self.bg_color, fg="#79c0ff", font=info_font)
+        output_label.pack(anchor=tk.W, pady=1)
+        
+        input_label = tk.Label(parent, text="⬆️ Вход: 0 / 0 ST", bg=self.bg_color, fg="#79c0ff", font=info_font)
+        input_label.pack(anchor=tk.W, pady=1)
+        
+        metrics_label = tk.Label(parent, text="⏱ Скан ещё не выполнялся", bg=self.bg_color, fg="#8b949e", font=info_font)
+        metrics_label.pack(anchor=tk.W, pady=(1, 0))
+        
+        refresh_label = tk.Label(parent, text="", bg=self.bg_color, fg="#8b949e", font=info_font)
+        refresh_label.pack(anchor=tk.W)
+        
+        # Разбивка по каталогам сессий — пустая, если каталог один
+        roots_label = tk.Label(parent, text="", bg=self.bg_color, fg="#8b949e", font=info_font, justify=tk.LEFT)
+        roots_label.pack(anchor=tk.W, pady=(0, 0))
+        
+        # Самые дорогие проекты и модели за период
+        top_label = tk.Label(parent, text="", bg=self.bg_color, fg="#8b949e", font=info_font, justify=tk.LEFT)
+        top_label.pack(anchor=tk.W, pady=(0, 6))
+        
+        sep2 = tk.Frame(parent, bg="#30363d", height=1)
+        sep2.pack(fill=tk.X, pady=4)
+        
+        overall_label = tk.Label(parent, text="Всего использовано", bg=self.bg_color, fg="#8b949e", font=info_font)
+        overall_label.pack(anchor=tk.W)
+        
+        progress_frame = tk.Frame(parent, bg="#30363d", height=8)
+        progress_frame.pack(fill=tk.X, pady=(2, 1))
+        
+        progress_bar = tk.Frame(progress_frame, bg="#238636", height=8)
+        progress_bar.pack(side=tk.LEFT, fill=tk.Y)
+        
+        percent_label = tk.Label(parent, text="0% / 20M", bg=self.bg_color, fg="#79c0ff", font=info_font)
+        percent_label.pack(anchor=tk.W, pady=(1, 4))
+        
+        cache_label2 = tk.Label(parent, text="Кэшированных токенов", bg=self.bg_color, fg="#8b949e", font=info_font)
+        cache_label2.pack(anchor=tk.W)
+        
+        cache_progress_frame = tk.Frame(parent, bg="#30363d", height=6)
+        cache_progress_frame.pack(fill=tk.X, pady=(2, 1))
+        
+        cache_progress_bar = tk.Frame(cache_progress_frame, bg="#79c0ff", height=6)
+        cache_progress_bar.pack(side=tk.LEFT, fill=tk.Y)
+        
+        cache_percent_label = tk.Label(parent, text="0% кэша", bg=self.bg_color, fg="#79c0ff", font=info_font)
+        cache_percent_label.pack(anchor=tk.W)
+        
+        sep3 = tk.Frame(parent, bg="#30363d", height=1)
+        sep3.pack(fill=tk.X, pady=8)
+        
+        settings_label = tk.Label(parent, text="Настройки", bg=self.bg_color, fg="#8b949e", font=info_font)
+        settings_label.pack(anchor=tk.W)
+        
+        mode_frame = tk.Frame(parent, bg=self.bg_color)
+        mode_frame.pack(anchor=tk.W, fill=tk.X, pady=4)
+        tk.Label(mode_frame, text="Режим:", bg=self.bg_color, fg="#79c0ff", font=info_font).pack(side=tk.LEFT)
+        tk.Button(mode_frame, text="Миниатюра (50×50)", command=self.toggle_miniature, bg="#58a6ff", fg="#ffffff", font=info_font, relief=tk.FLAT).pack(side=tk.LEFT, padx=5)
+        
+        alpha_label = tk.Label(parent, text="Прозрачность:", bg=self.bg_color, fg="#79c0ff", font=info_font)
+        alpha_label.pack(anchor=tk.W)
+        
+        alpha_scale = tk.Scale(parent, from_=0.3, to=1.0, resolution=0.05, orient=tk.HORIZONTAL, bg="#1c2128", fg="#79c0ff", length=350, command=self.change_alpha, highlightthickness=0, bd=0)
+        alpha_scale.set(self.alpha_value)
+        alpha_scale.pack(anchor=tk.W, fill=tk.X, padx=2)
+        
+        btn_frame = tk.Frame(parent, bg=self.bg_color)
+        btn_frame.pack(pady=8, fill=tk.X)
+        
+        btn_font = self.get_font(8)
+        tk.Button(btn_frame, text="↻", command=self.refresh_sessions, bg="#238636", fg="#ffffff", font=btn_font, width=4, relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        tk.Button(btn_frame, text="✕", command=self.reset, bg="#da3633", fg="#ffffff", font=btn_font, width=4, relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        tk.Button(btn_frame, text="⚙", command=self.reset_position, bg="#0969da", fg="#ffffff", font=btn_font, width=4, relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        tk.Button(btn_frame, text="📋", command=self.copy_to_clipboard, bg="#1f6feb", fg="#ffffff", font=btn_font, width=4, relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        tk.Button(btn_frame, text="🔔", command=lambda: self.toggle_notify(), bg="#6e40aa", fg="#ffffff", font=btn_font, width=4, relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        tk.Button(btn_frame, text="🚀", command=self.toggle_autostart, bg="#f85149", fg="#ffffff", font=btn_font, width=4, relief=tk.FLAT).pack(side=tk.LEFT, padx=1)
+        
+        return {
+            "total_label": total_label,
+            "period_label": period_label,
+            "model_label": model_label,
+            "cache_label": cache_label,
+            "output_label": output_label,
+            "input_label": input_label,
+            "metrics_label": metrics_label,
+            "refresh_label": refresh_label,
+            "roots_label": roots_label,
+            "top_label": top_label,
+            "progress_bar": progress_bar,
+            "percent_label": percent_label,
+            "cache_progress_bar": cache_progress_bar,
+            "cache_percent_label": cache_percent_label,
+            "alpha_scale": alpha_scale,
+        }
+    
+    def load_data(self):
+        data = self.config.load()
+        self.total_session = data.get("total", 0)
+        self.alpha_value = data.get("alpha", 0.95)
+        self.current_x = data.get("pos_x", 50)
+        self.current_y = data.get("pos_y", 50)
+        self.theme = data.get("theme", self.THEME_DARK)
+        self.miniature_mode = data.get("miniature", False)
+        self.notify_enabled = data.get("notify", True)
+        self.scan_workers = data.get("scan_workers", self.DEFAULT_SCAN_WORKERS)
+        # Интервал проверки сессий: min_seconds при изменениях, откат в backoff раз до max_seconds
+        self.refresh_policy = RefreshScheduler.from_config(data.get("refresh")).policy()
+        self.ui_refresh = RefreshScheduler(
+            self.refresh_policy["min_seconds"],
+            min(self.refresh_policy["max_seconds"], self.SNAPSHOT_POLL_MAX_SECONDS),
+            self.refresh_policy["backoff"],
+        )
+        self.refresh_job = None
+        self.refresh_started = False
+        self.window_hidden = False
+        # null в конфиге отключает файл метрик
+        self.metrics_file = data.get("metrics_file", self.default_metrics_path)
+        # Бинарный снимок итогов для строк статуса и плагинов; null — не писать
+        self.snapshot_file = data.get("snapshot_file", self.default_snapshot_path)
+        # Расчётный период лимита: день начала и сброс (monthly/never)
+        self.billing_start_day = data.get("billing_start_day", 1)
+        self.billing_reset = data.get("billing_reset", "monthly")
+        self.billing = BillingWindow(self.billing_start_day, self.billing_reset)
+        # Каталоги сессий: итог и процент считаются по всем сразу
+        self.session_roots = data.get("session_roots") or [DEFAULT_SESSIONS_DIR]
+        # Адрес локального агрегатора; null — всегда сканировать самому
+        self.aggregator_url = data.get("aggregator_url", DEFAULT_AGGREGATOR_URL)
+        
+        # Если total == 0, загружаем историю из файла истории (восстановление при первом запуске)
+        if self.total_session == 0:
+            self.total_session = self.load_history_total()
+        
+        self.scan_metrics = None
+        self.billing_period = None
+        self.root_totals = None
+        self.breakdowns = None
+        # Модель и разбивка токенов последней сессии
+        self.latest_usage = EMPTY_USAGE
+    
+    def load_index_totals(self):
+        """До первого скана показать итоги из постоянных индексов — они точнее сохранённого total"""
+        snapshot = self.session_scanner.merge()
+        if snapshot.latest_ns is None:
+            return
+        # С расчётным периодом — расход периода из дневных сводок индекса
+        self.total_session = snapshot.window["total_st"] if snapshot.window else snapshot.total
+        self.billing_period = snapshot.window
+        self.root_totals = snapshot.roots
+        self.apply_session_data(snapshot.usage)
+    
+    def load_history_total(self):
+        """Загружает общее количество токенов из файла истории"""
+        try:
+            return self.history.load_total()
+        except:
+            return 0
+    
+    def save_data(self):
+        # Только в память: ConfigStore сам запишет файл после паузы в изменениях,
+        # поэтому перетаскивание и ползунок прозрачности не дёргают диск
+        self.config.update({
+            "total": self.total_session,
+            "alpha": self.alpha_value,
+            "pos_x": self.current_x,
+            "pos_y": self.current_y,
+            "theme": self.theme,
+            "miniature": self.miniature_mode,
+            "notify": self.notify_enabled,
+            "scan_workers": self.scan_workers,
+            "refresh": self.refresh_policy,
+            "metrics_file": self.metrics_file,
+            "snapshot_file": self.snapshot_file,
+            "billing_start_day": self.billing_start_day,
+            "billing_reset": self.billing_reset,
+            "session_roots": self.session_roots,
+            "aggregator_url": self.aggregator_url
+        })
+    
+    def save_history(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        
+        try:
+            self.history.record(today, self.total_session)
+        except:
+            pass
+    
+    def check_limit_warning(self):
+        total_st = self.total_session
+        percent = (total_st / self.MONTHLY_LIMIT) * 100
+        
+        # В новом расчётном периоде предупреждения снова показываются один раз
+        period = self.billing_period["start"] if self.billing_period else None
+        if period != getattr(self, '_warning_period', period):
+            self._warning_shown = False
+        self._warning_period = period
+        
+        if self.notify_enabled and not getattr(self, '_warning_shown', False):
+            if percent >= 95:
+                self.show_notification("🚨 Критично!", f"Использовано {percent:.1f}% лимита! Скоро закончатся токены!")
+                self._warning_shown = True
+            elif percent >= 90:
+                self.show_notification("⚠️ Внимание!", f"Использовано {percent:.1f}% лимита токенов!")
+                self._warning_shown = True
+    
+    def show_notification(self, title, message):
+        try:
+            if self.notify_enabled:
+                messagebox.showwarning(title, message)
+        except:
+            pass
+    
+    def toggle_autostart(self):
+        try:
+            script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+            startup_folder = os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Microsoft", "Windows", "Start Menu", "Programs", "Startup")
+            
+            bat_file = os.path.join(startup_folder, "token_tracker.bat")
+            
+            if os.path.exists(bat_file):
+                os.remove(bat_file)
+                messagebox.showinfo("Успех", "Автозапуск отключен")
+                return False
+            else:
+                with open(bat_file, "w") as f:
+                    f.write(f'@echo off\npython "{script_path}"\n')
+                messagebox.showinfo("Успех", "Автозапуск включен")
+                return True
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось изменить автозапуск: {e}")
+    
+    def is_autostart_enabled(self):
+        startup_folder = os.path.join(os.path.expanduser("~"), "AppData", "Roaming", "Microsoft", "Windows", "Start Menu", "Programs", "Startup")
+        bat_file = os.path.join(startup_folder, "token_tracker.bat")
+        return os.path.exists(bat_file)
+    
+    def copy_to_clipboard(self):
+        try:
+            total_st = self.total_session
+            percent = (total_st / self.MONTHLY_LIMIT) * 100
+            
+            text = f"Token Tracker: {total_st:,} ST ({percent:.2f}% лимита)"
+            
+            self.root.clipboard_clear()
+            self.root.clipboard_append(text)
+            self.root.update()
+            messagebox.showinfo("Успех", "Скопировано в буфер обмена")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось скопировать: {e}")
+    
+    def refresh_sessions(self):
+        """Запросить у фонового сканера полный пересчёт всех сессий"""
+        self.session_scanner.request_full_scan()
+    
+    def apply_session_data(self, usage):
+        """Применить модель и разбивку токенов последней сессии к состоянию UI"""
+        if usage.model is None:
+            # У сессии без tokenUsage нет разбивки — остаётся прежняя
+            usage = self.latest_usage._replace(model=None)
+        self.latest_usage = usage
+    
+    def reset(self):
+        self.total_session = 0
+        self.save_data()
+        self.update_display()
+    
+    def display_mode(self):
+        if self.miniature_mode:
+            return MODE_MINIATURE
+        return MODE_COMPACT if self.compact_mode else MODE_FULL
+    
+    def update_display(self):
+        # total_session содержит сумму всех сессий Factory
+        state = build_view_state(
+            self.display_mode(), self.total_session, self.latest_usage,
+            self.scan_metrics, self.billing_period, self.root_totals, self.breakdowns,
+            self.session_scanner.refresh_state(),
+        )
+        
+        # Трогаем только виджеты, у которых что-то изменилось с прошлой отрисовки
+        for name, options in diff_view_state(self.rendered_state, state).items():
+            widget = self.widgets.get(name)
+            if widget is None:
+                continue
+            try:
+                widget.config(**options)
+            except tk.TclError:
+                continue
+            self.rendered_state.setdefault(name, {}).update(options)
+    
+    def report_startup_probe(self):
+        """Для бенчмарка старта: напечатать время до первого update_display и выйти"""
+        launched_at = os.environ.get(STARTUP_PROBE_ENV)
+        if not launched_at:
+            return
+        print(f"STARTUP_SECONDS {time.time() - float(launched_at):.4f}", flush=True)
+        self.root.after_idle(self.root.quit)
+    
+    def after_first_paint(self):
+        self.session_scanner.start()
+        self.refresh_started = True
+        self.schedule_refresh()
+        self.setup_tray()
+    
+    def schedule_refresh(self):
+        """Забрать свежий снимок у фонового сканера и перерисовать виджет; следующий раз — через ui_refresh.interval"""
+        self.refresh_job = None
+        snapshot = self.session_scanner.latest_snapshot()
+        if snapshot is not None:
+            self.ui_refresh.activity()
+            self.apply_snapshot(snapshot)
+        else:
+            self.ui_refresh.idle()
+            if self.display_mode() == MODE_FULL:
+                # Интервал проверок меняется и без новых снимков
+                self.update_display()
+        if not self.ui_refresh.paused:
+            self.refresh_job = self.root.after(int(self.ui_refresh.interval * 1000), self.schedule_refresh)
+    
+    def update_refresh_pause(self):
+        """Скрытое окно не проверяет сессии — если только не нужны уведомления о лимите"""
+        if self.window_hidden and not self.notify_enabled:
+            self.session_scanner.pause()
+            self.ui_refresh.pause()
+            if self.refresh_job is not None:
+                self.root.after_cancel(self.refresh_job)
+                self.refresh_job = None
+        else:
+            self.session_scanner.resume()
+            self.ui_refresh.resume()
+            if self.refresh_started and self.refresh_job is None:
+                self.refresh_job = self.root.after(0, self.schedule_refresh)
+    
+    def apply_snapshot(self, snapshot):
+        """Один цикл обновления: показать снимок, записать историю, проверить лимит"""
+        # С расчётным периодом процент и итог считаются от расхода внутри него
+        self.total_session = snapshot.window["total_st"] if snapshot.window else snapshot.total
+        self.billing_period = snapshot.window
+        self.scan_metrics = snapshot.metrics
+        self.root_totals = snapshot.roots
+        self.breakdowns = snapshot.breakdowns
+        self.apply_session_data(snapshot.usage)
+        self.update_display()
+        self.save_history()
+        self.check_limit_warning()
+    
+    def setup_tray(self):
+        # pystray и PIL грузим только здесь, уже после первой отрисовки
+        try:
+            from pystray import Icon, Menu, MenuItem
+            from PIL import Image, ImageDraw
+        except ImportError:
+            return
+        
+        def show_window(icon, item):
+            self.root.after(0, self.show_window)
+        
+        def hide_window_menu(icon, item):
+            self.root.after(0, self.hide_window)
+        
+        def quit_app(icon, item):
+            icon.stop()
+            self.root.after(100, self.root.quit)
+        
+        try:
+            # Создаём красивую иконку
+            image = Image.new('RGB', (64, 64), color='#1c2128')
+            draw = ImageDraw.Draw(image)
+            # Рисуем голубой квадрат с буквой T
+            draw.rectangle([4, 4, 60, 60], fill='#58a6ff', outline='#0d1117', width=2)
+            draw.text((22, 18), 'T', fill='#0d1117')
+        except:
+            # Если не получилось, просто голубой квадрат
+            image = Image.new('RGB', (64, 64), color='#58a6ff')
+        
+        menu = Menu(
+            MenuItem('Показать', show_window),
+            MenuItem('Скрыть', hide_window_menu),
+            MenuItem('Выход', quit_app)
+        )
+        
+        try:
+            self.icon = Icon("token_tracker", image, menu=menu, default_menu_index=0)
+            # Добавляем обработчик левого клика
+            self.icon.left_click = show_window
+            self.tray_thread = threading.Thread(target=self.icon.run, daemon=True)
+            self.tray_thread.start()
+        except Exception as e:
+            print(f"Ошибка создания трея: {e}")
+            raise
+    
+    def hide_window(self):
+        self.root.withdraw()
+        self.window_hidden = True
+        self.update_refresh_pause()
+    
+    def show_window(self):
+        self.root.deiconify()
+        self.root.lift()
+        self.window_hidden = False
+        self.update_refresh_pause()
+    
+    def on_click(self, event):
+        self.drag_data["x"] = event.x_root - self.root.winfo_x()
+        self.drag_data["y"] = event.y_root - self.root.winfo_y()
+        current_time = self.root.tk.call('clock', 'clicks', '-milliseconds')
+        if hasattr(self, '_last_click_time') and (current_time - self._last_click_time) < 400:
+            self.toggle_mode()
+            self._last_click_time = 0
+        else:
+            self._last_click_time = current_time
+    
+    def on_drag(self, event):
+        x = event.x_root - self.drag_data["x"]
+        y = event.y_root - self.drag_data["y"]
+        
+        screen_w = self.root.winfo_screenwidth()
+        screen_h = self.root.winfo_screenheight()
+        
+        if self.miniature_mode:
+            w, h = 50, 50
+        elif self.compact_mode:
+            w, h = 170, 150
+        else:
+            w, h = 420, 580
+        
+        if x < 0:
+            x = 0
+        if y < 0:
+            y = 0
+        if x + w > screen_w:
+            x = max(0, screen_w - w)
+        if y + h > screen_h:
+            y = max(0, screen_h - h)
+        
+        self.root.geometry(f"+{x}+{y}")
+        
+        self.current_x = x
+        self.current_y = y
+        self.save_data()
+    
+    def toggle_mode(self, event=None):
+        screen_w = self.root.winfo_screenwidth()
+        screen_h = self.root.winfo_screenheight()
+        
+        old_x = self.root.winfo_x()
+        old_y = self.root.winfo_y()
+        old_w = self.root.winfo_width()
+        old_h = self.root.winfo_height()
+        
+        # Вычисляем якоря: прижато ли к краям?
+        at_left = old_x < 10
+        at_right = (old_x + old_w) > (screen_w - 10)
+        at_top = old_y < 10
+        at_bottom = (old_y + old_h) > (screen_h - 10)
+        
+        if self.miniature_mode:
+            # Переход из микро в компактный
+            self.miniature_mode = False
+            self.compact_mode = True
+            w, h = 170, 150
+        elif self.compact_mode:
+            # Переход из компактного в полный
+            self.miniature_mode = False
+            self.compact_mode = False
+            w, h = 420, 580
+        else:
+            # Переход из полного в микро
+            self.miniature_mode = True
+            self.compact_mode = False
+            w, h = 50, 50
+        
+        # Вычисляем новую позицию с учетом якорей
+        if at_left:
+            new_x = 0
+        elif at_right:
+            new_x = screen_w - w
+        else:
+            new_x = old_x
+        
+        if at_top:
+            new_y = 0
+        elif at_bottom:
+            new_y = screen_h - h
+        else:
+            new_y = old_y
+        
+        # Страховка на случай если вычисления дали отрицательные значения
+        new_x = max(0, min(new_x, screen_w - w))
+        new_y = max(0, min(new_y, screen_h - h))
+        
+        self.current_x = new_x
+        self.current_y = new_y
+        self.root.geometry(f"{w}x{h}+{new_x}+{new_y}")
+        
+        self.save_data()
+        self.create_ui()
+        self.update_display()
+    
+    def show_menu(self, event=None):
+        menu = tk.Menu(self.root, tearoff=0, bg="#1c2128", fg="#c9d1d9")
+        menu.add_command(label="Развернуть/Свернуть", command=self.toggle_mode)
+        menu.add_command(label="Обновить", command=self.refresh_sessions)
+        menu.add_separator()
+        menu.add_command(label="Выход", command=self.root.quit)
+        menu.post(event.x_root, event.y_root)
+    
+    def change_alpha(self, value):
+        alpha = float(value)
+        self.alpha_value = alpha
+        self.root.attributes("-alpha", alpha)
+        self.save_data()
+    
+    def toggle_notify(self):
+        self.notify_enabled = not self.notify_enabled
+        self.update_refresh_pause()
+        self.save_data()
+        status = "включены" if self.notify_enabled else "отключены"
+        messagebox.showinfo("Уведомления", f"Уведомления {status}")
+    
+    def toggle_miniature(self):
+        screen_w = self.root.winfo_screenwidth()
+        screen_h = self.root.winfo_screenheight()
+        
+        old_x = self.root.winfo_x()
+        old_y = self.root.winfo_y()
+        old_w = self.root.winfo_width()
+        old_h = self.root.winfo_height()
+        
+        # Вычисляем якоря: прижато ли к краям?
+        at_left = old_x < 10
+        at_right = (old_x + old_w) > (screen_w - 10)
+        at_top = old_y < 10
+        at_bottom = (old_y + old_h) > (screen_h - 10)
+        
+        self.miniature_mode = not self.miniature_mode
+        self.compact_mode = not self.miniature_mode
+        
+        if self.miniature_mode:
+            w, h = 50, 50
+        else:
+            w, h = 170, 150
+        
+        # Вычисляем новую позицию с учетом якорей
+        if at_left:
+            new_x = 0
+        elif at_right:
+            new_x = screen_w - w
+        else:
+            new_x = old_x
+        
+        if at_top:
+            new_y = 0
+        elif at_bottom:
+            new_y = screen_h - h
+        else:
+            new_y = old_y
+        
+        # Страховка на случай если вычисления дали отрицательные значения
+        new_x = max(0, min(new_x, screen_w - w))
+        new_y = max(0, min(new_y, screen_h - h))
+        
+        self.current_x = new_x
+        self.current_y = new_y
+        self.root.geometry(f"{w}x{h}+{new_x}+{new_y}")
+        self.save_data()
+        self.create_ui()
+        self.update_display()
+    
+    def reset_position(self):
+        self.current_x = 50
+        self.current_y = 50
+        if self.miniature_mode:
+            self.root.geometry(f"50x50+{self.current_x}+{self.current_y}")
+        elif self.compact_mode:
+            self.root.geometry(f"170x150+{self.current_x}+{self.current_y}")
+        else:
+            self.root.geometry(f"420x580+{self.current_x}+{self.current_y}")
+        self.save_data()
+    
+    def run(self):
+        try:
+            self.root.mainloop()
+        finally:
+            # Гарантируем очистку при выходе
+            self.cleanup_on_exit()
+    
+    def cleanup_on_exit(self):
+        """Очистка при выходе"""
+        try:
+            if self.icon:
+                self.icon.stop()
+        except:
+            pass
+        try:
+            self.single_instance.release()
+        except:
+            pass
+        try:
+            self.session_scanner.stop()
+        except:
+            pass
+        try:
+            self.config.close()
+        except:
+            pass